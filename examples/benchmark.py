@@ -26,7 +26,7 @@ import coloredlogs
 import logging
 import matplotlib
 import matplotlib.pyplot as plt
-from statdp import detect_counterexample, ONE_DIFFER, ALL_DIFFER
+from statdp import Detector, ONE_DIFFER, ALL_DIFFER
 from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, noisy_max_v2a, noisy_max_v2b, SVT, iSVT1,\
     iSVT2, iSVT3, iSVT4, histogram, histogram_eps
 
@@ -101,13 +101,17 @@ def main():
     # privacy levels to test, here we test from a range of 0.1 - 2.0 with a stepping of 0.1
     test_privacy = tuple(x / 10.0 for x in range(1, 20, 1))
 
+    # all detections share the same worker processes
+    detector = Detector()
     for i, (algorithm, kwargs, sensitivity) in enumerate(tasks):
         start_time = time.time()
         results = {}
         for privacy_budget in claimed_privacy:
             # set the third argument of the function (assumed to be `epsilon`) to the claimed privacy level
             kwargs[algorithm.__code__.co_varnames[2]] = privacy_budget
-            results[privacy_budget] = detect_counterexample(algorithm, test_privacy, kwargs, sensitivity=sensitivity)
+            # the event selection samples are shared across all test epsilons
+            results[privacy_budget] = detector.detect(algorithm, test_privacy, kwargs, sensitivity=sensitivity,
+                                                      reuse_samples=True)
 
         # dump the results to file
         json_file = pathlib.Path.cwd() / f'{algorithm.__name__}.json'
@@ -129,6 +133,7 @@ def main():
         total_time, total_detections = time.time() - start_time, len(claimed_privacy) * len(test_privacy)
         logger.info(f'[{i + 1} / {len(tasks)}]: {algorithm.__name__} | Time elapsed: {total_time:5.3f}s | '
                     f'Average time per detection: {total_time / total_detections:5.3f}s')
+    detector.close()
 
 
 if __name__ == '__main__':
@@ -28,6 +28,7 @@ setup(
     install_requires=['numpy', 'tqdm', 'numba'],
     extras_require={
         'test': ['pytest-cov', 'pytest', 'coverage', 'flaky', 'scipy'],
+        'yaml': ['pyyaml'],
     },
     entry_points={
         'console_scripts': [
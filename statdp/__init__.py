@@ -19,21 +19,39 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import importlib
 import logging
-import multiprocessing as mp
-
-import tqdm
 
 from statdp.generators import generate_arguments, generate_databases, ALL_DIFFER, ONE_DIFFER
-from statdp.hypotest import hypothesis_test
-from statdp.selectors import select_event
 
-logger = logging.getLogger(__name__)
+# the submodules pulling in numba, tqdm, asyncio, etc. are imported on first access of their names, so that importing
+# statdp (e.g., in the workers or for a short command) does not pay for the parts it does not use
+_LAZY_NAMES = {
+    'AsyncDetector': 'statdp.aio',
+    'adetect_counterexample': 'statdp.aio',
+    'Detector': 'statdp.detector',
+    'hypothesis_test': 'statdp.hypotest',
+    'select_event': 'statdp.selectors',
+    'sample_events': 'statdp.selectors',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
 
 
 def detect_counterexample(algorithm, test_epsilon, default_kwargs=None, databases=None, num_input=(5, 10),
                           event_iterations=100000, detect_iterations=500000, cores=None, sensitivity=ALL_DIFFER,
-                          quiet=False, loglevel=logging.INFO):
+                          quiet=False, loglevel=logging.INFO, reuse_samples=False, seed=None,
+                          alpha=None, adaptive_selection=False, executor='process', concurrent_epsilons=2):
     """
     :param algorithm: The algorithm to test for.
     :param test_epsilon: The privacy budget to test for, can either be a number or a tuple/list.
@@ -42,45 +60,33 @@ def detect_counterexample(algorithm, test_epsilon, default_kwargs=None, database
     :param num_input: The length of input to generate, not used if database param is specified.
     :param event_iterations: The iterations for event selector to run.
     :param detect_iterations: The iterations for detector to run.
-    :param cores: The number of max processes to set for multiprocessing.Pool(), os.cpu_count() is used if None.
+    :param cores: The number of max workers for the process / thread pool, os.cpu_count() is used if None.
     :param sensitivity: The sensitivity setting, all queries can differ by one or just one query can differ by one.
     :param quiet: Do not print progress bar or messages, logs are not affected.
     :param loglevel: The loglevel for logging package.
-    :return: [(epsilon, p, d1, d2, kwargs, event)] The epsilon-p pairs along with databases/arguments/selected event.
+    :param reuse_samples: Run the event selector once on each input and select the events for all test epsilons from
+    the same samples, instead of re-running it for each test epsilon.
+    :param seed: The seed (None, an int or a np.random.SeedSequence) to reproduce the detection, the results are
+    identical for the same seed regardless of the number of cores.
+    :param alpha: If given, the hypothesis tests are run sequentially at significance level alpha and stop early once
+    the decision is settled (see `statdp.hypotest.sequential_test`), detect_iterations is then the maximum iterations.
+    :param adaptive_selection: Select the events with successive halving (see `statdp.selectors.select_event_halving`),
+    which spends the event_iterations * (number of inputs) budget mostly on the promising inputs.
+    :param executor: The workers to run the algorithm with, 'process' (multiprocessing.Pool()), 'thread'
+    (concurrent.futures.ThreadPoolExecutor, for algorithms releasing the GIL), 'serial' (in the current process) or an
+    existing multiprocessing.Pool() or concurrent.futures.Executor, see `Detector`.
+    :param concurrent_epsilons: The number of test epsilons to process at the same time on the workers, so that the
+    event selection of an epsilon overlaps the hypothesis test of another, default is 2. The worker utilization is
+    reported in the logs.
+    :return: [(epsilon, p, d1, d2, kwargs, event)] The epsilon-p pairs along with databases/arguments/selected event,
+    with the iterations used by the hypothesis test appended if :alpha: is given.
     """
-    # initialize an empty default kwargs if None is given
-    default_kwargs = default_kwargs if default_kwargs else {}
-
+    from statdp.detector import Detector
     logging.basicConfig(level=loglevel)
-    logger.info(f'Start detection for counterexample on {algorithm.__name__} with test epsilon {test_epsilon}')
-    logger.info(f'Options -> default_kwargs: {default_kwargs} | databases: {databases} | cores:{cores}')
-
-    input_list = []
-    if databases is not None:
-        d1, d2 = databases
-        kwargs = generate_arguments(algorithm, d1, d2, default_kwargs=default_kwargs)
-        input_list = ((d1, d2, kwargs),)
-    else:
-        num_input = (int(num_input), ) if isinstance(num_input, (int, float)) else num_input
-        for num in num_input:
-            input_list.extend(
-                generate_databases(algorithm, num, default_kwargs=default_kwargs, sensitivity=sensitivity))
-
-    result = []
-
-    # convert int/float or iterable into tuple (so that it has length information)
-    test_epsilon = (test_epsilon, ) if isinstance(test_epsilon, (int, float)) else test_epsilon
-
-    with mp.Pool(cores) as pool:
-        for _, epsilon in tqdm.tqdm(enumerate(test_epsilon), total=len(test_epsilon), unit='test', desc='Detection',
-                                    disable=quiet):
-            d1, d2, kwargs, event = select_event(algorithm, input_list, epsilon, event_iterations, quiet=quiet,
-                                                 process_pool=pool)
-            p = hypothesis_test(algorithm, d1, d2, kwargs, event, epsilon, detect_iterations, report_p2=False,
-                                process_pool=pool)
-            result.append((epsilon, float(p), d1, d2, kwargs, event))
-            if not quiet:
-                tqdm.tqdm.write(f'Epsilon: {epsilon} | p-value: {p:5.3f} | Event: {event}')
-            logger.debug(f'D1: {d1} | D2: {d2} | kwargs: {kwargs}')
-
-        return result
+    # a one-off session, use `Detector` directly to run multiple detections with the same worker processes
+    with Detector(cores, executor=executor) as detector:
+        return detector.detect(algorithm, test_epsilon, default_kwargs=default_kwargs, databases=databases,
+                               num_input=num_input, event_iterations=event_iterations,
+                               detect_iterations=detect_iterations, sensitivity=sensitivity, quiet=quiet,
+                               reuse_samples=reuse_samples, seed=seed, alpha=alpha,
+                               adaptive_selection=adaptive_selection, concurrent_epsilons=concurrent_epsilons)
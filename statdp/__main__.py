@@ -0,0 +1,302 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" The `statdp` command, which runs the detections listed in a YAML / JSON job file, e.g.,
+
+defaults:
+  test_epsilon: {start: 0.1, stop: 2.0, step: 0.1}
+  claimed_epsilon: [0.2, 0.7, 1.5]
+jobs:
+  - algorithm: statdp.algorithms:noisy_max_v1a
+  - algorithm: statdp.algorithms:SVT
+    kwargs: {N: 1, T: 0.5}
+  - algorithm: statdp.algorithms:histogram
+    sensitivity: ONE_DIFFER
+    alpha: 0.05
+
+Each job runs its algorithm (given by its import path) with each claimed epsilon, which is passed as the privacy budget
+argument (the third argument) of the algorithm, and tests the epsilons of test_epsilon. The keys of `defaults` apply to
+all jobs, see `_JOB_KEYS` for the keys a job can set. The detections of all jobs run on one shared pool of workers (see
+`statdp.aio`) and the results are written as JSON lines as soon as each detection finishes:
+
+statdp jobs.yaml --output results.jsonl --cores 8
+"""
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import logging
+import math
+import os
+import pathlib
+import sys
+import time
+
+from statdp.generators import Sensitivity
+
+logger = logging.getLogger(__name__)
+
+# the arguments of the detection a job can set, see `detect_counterexample`
+_DETECTION_KEYS = ('databases', 'num_input', 'event_iterations', 'detect_iterations', 'reuse_samples', 'seed', 'alpha',
+                   'adaptive_selection')
+_JOB_KEYS = ('name', 'algorithm', 'kwargs', 'claimed_epsilon', 'test_epsilon', 'sensitivity') + _DETECTION_KEYS
+
+
+def _import_algorithm(path):
+    """ Import the algorithm from its path, either 'module:name' or 'module.name'. """
+    module_name, _, name = path.rpartition(':') if ':' in path else path.rpartition('.')
+    if not module_name:
+        raise ValueError(f'algorithm should be given as module:name, got {path!r}')
+    algorithm = getattr(importlib.import_module(module_name), name, None)
+    if not callable(algorithm):
+        raise ValueError(f'{path!r} is not a callable algorithm')
+    return algorithm
+
+
+def _grid(value):
+    """ Return the epsilons of a grid given as a number, a list or {start, stop, step} (both ends included). """
+    if isinstance(value, dict):
+        if set(value) != {'start', 'stop', 'step'} or value['step'] <= 0:
+            raise ValueError(f'a range of epsilons should be {{start, stop, step}} with step > 0, got {value}')
+        number = int(round((value['stop'] - value['start']) / value['step'])) + 1
+        # rounding removes the floating point error of the steps, e.g., 0.30000000000000004
+        return tuple(round(value['start'] + index * value['step'], 10) for index in range(number))
+    if isinstance(value, (list, tuple)):
+        return tuple(float(epsilon) for epsilon in value)
+    return float(value),
+
+
+def _parse_job(job, index):
+    unknown_keys = set(job) - set(_JOB_KEYS)
+    if unknown_keys:
+        raise ValueError(f'job {index}: unknown keys {sorted(unknown_keys)}, the keys are {list(_JOB_KEYS)}')
+    if 'algorithm' not in job or 'test_epsilon' not in job:
+        raise ValueError(f'job {index}: algorithm and test_epsilon must be given')
+    sensitivity = job.get('sensitivity', 'ALL_DIFFER')
+    if sensitivity not in Sensitivity.__members__:
+        raise ValueError(f'job {index}: sensitivity must be one of {list(Sensitivity.__members__)}')
+
+    algorithm = _import_algorithm(job['algorithm'])
+    options = {key: job[key] for key in _DETECTION_KEYS if key in job}
+    if 'num_input' in options:
+        options['num_input'] = tuple(options['num_input'])
+    return {
+        'name': job.get('name', job['algorithm'].replace(':', '.').rpartition('.')[2]),
+        'algorithm': algorithm,
+        'kwargs': dict(job.get('kwargs', {})),
+        'claimed_epsilon': _grid(job['claimed_epsilon']) if 'claimed_epsilon' in job else (None, ),
+        'test_epsilon': _grid(job['test_epsilon']),
+        'sensitivity': Sensitivity[sensitivity],
+        'options': options
+    }
+
+
+def load_jobs(path):
+    """ Load and check the jobs of a job file (see `statdp.__main__`), YAML files (.yaml / .yml) need PyYAML.
+    :param path: The path of the job file.
+    :return: list of the jobs, with the algorithms imported and the defaults applied.
+    """
+    path = pathlib.Path(path)
+    if path.suffix in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('reading YAML job files needs PyYAML (pip install pyyaml), or use a JSON job file') \
+                from None
+        document = yaml.safe_load(path.read_text())
+    else:
+        document = json.loads(path.read_text())
+    # a job file can also be a plain list of jobs
+    document = {'jobs': document} if isinstance(document, list) else document
+    if not isinstance(document, dict) or not document.get('jobs'):
+        raise ValueError(f'{path} does not list any jobs')
+
+    defaults = document.get('defaults', {})
+    jobs = []
+    for index, job in enumerate(document['jobs']):
+        if not isinstance(job, dict):
+            raise ValueError(f'job {index}: a job should be a mapping of its keys, got {job!r}')
+        # the kwargs of a job are added to the default kwargs instead of replacing them
+        kwargs = dict(defaults.get('kwargs', {}), **job.get('kwargs', {}))
+        jobs.append(_parse_job({**defaults, **job, 'kwargs': kwargs}, index))
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError(f'the names of the jobs must be unique, got {names}, set the name of the jobs')
+    return jobs
+
+
+def _detections(jobs):
+    """ Return the [(job, claimed epsilon, kwargs)] of the detections of the jobs. """
+    detections = []
+    for job in jobs:
+        for claimed_epsilon in job['claimed_epsilon']:
+            kwargs = dict(job['kwargs'])
+            if claimed_epsilon is not None:
+                # the privacy budget is the third argument of the algorithm, see the README
+                parameters = list(inspect.signature(getattr(job['algorithm'], 'py_func', job['algorithm'])).parameters)
+                if len(parameters) < 3:
+                    raise ValueError(f'{job["name"]}: the algorithm has no privacy budget argument for claimed_epsilon')
+                kwargs[parameters[2]] = claimed_epsilon
+            detections.append((job, claimed_epsilon, kwargs))
+    return detections
+
+
+def _finished_detections(output):
+    """ Return the {(job name, claimed epsilon)} of the detections with results in the output file. """
+    finished = set()
+    with open(output) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted run
+                logger.warning(f'skipping an incomplete line of {output}')
+                continue
+            finished.add((record['job'], record['claimed_epsilon']))
+    return finished
+
+
+def _to_json(value):
+    """ Convert the value to plain JSON types, the infinities (e.g., the -inf of the (-inf, alpha) events) and NaNs are
+    written as the strings "inf", "-inf" and "nan" since JSON has no representation for them. """
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if hasattr(value, 'tolist'):
+        # numpy arrays and numbers in the databases / events
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+async def _run_detections(detections, session, output_file, concurrent_jobs):
+    """ Run the detections on the session with at most :concurrent_jobs: of them at the same time, the results of a
+    detection are written as soon as it finishes.
+    :return: The number of failed detections.
+    """
+    semaphore = asyncio.Semaphore(concurrent_jobs)
+    finished, failed = 0, 0
+
+    async def run_detection(job, claimed_epsilon, kwargs):
+        nonlocal finished, failed
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                results = await session.detect(job['algorithm'], job['test_epsilon'], kwargs,
+                                               sensitivity=job['sensitivity'], **job['options'])
+            except Exception:
+                # a failing job (e.g., an algorithm with a bug) should not stop the other jobs
+                failed += 1
+                logger.exception(f'{job["name"]} (claimed epsilon {claimed_epsilon}) failed')
+                return
+            elapsed = time.perf_counter() - start_time
+
+        records = []
+        for epsilon, p, d1, d2, result_kwargs, event, *iterations in results:
+            record = {'job': job['name'], 'claimed_epsilon': claimed_epsilon, 'test_epsilon': epsilon, 'p': p,
+                      'd1': d1, 'd2': d2, 'kwargs': result_kwargs, 'event': event, 'time': elapsed}
+            if iterations:
+                record['iterations'] = iterations[0]
+            records.append(json.dumps(_to_json(record), allow_nan=False) + '\n')
+        # the records of a detection are written at once, so that an interrupted run leaves at most one incomplete line
+        output_file.write(''.join(records))
+        output_file.flush()
+        finished += 1
+        logger.info(f'[{finished + failed} / {len(detections)}] {job["name"]} (claimed epsilon {claimed_epsilon}) | '
+                    f'Time elapsed: {elapsed:5.3f}s')
+
+    await asyncio.gather(*(run_detection(*detection) for detection in detections))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='statdp', description='Run the detections of a YAML / JSON job file on a '
+                                                                'shared pool of workers.')
+    parser.add_argument('job_file', help='the YAML / JSON file listing the jobs, see `statdp.__main__`')
+    parser.add_argument('-o', '--output', default='-',
+                        help='the JSON lines file to write the results to, the standard output by default')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the detections with results in the output file and append the others to it')
+    parser.add_argument('--cores', type=int, default=None, help='the number of workers, os.cpu_count() by default')
+    parser.add_argument('--executor', choices=('process', 'thread'), default='process',
+                        help='run the workers in processes (default) or threads (for algorithms releasing the GIL)')
+    parser.add_argument('--max-tasks', type=int, default=None,
+                        help='the maximum number of blocks of iterations on the workers, 2 per worker by default')
+    parser.add_argument('--concurrent-jobs', type=int, default=2,
+                        help='the number of detections running at the same time, default is 2')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='the memory (in bytes) for the outputs of the algorithm in each task')
+    parser.add_argument('--alpha', type=float, default=None,
+                        help='stop the hypothesis tests early at this significance level (see '
+                             '`statdp.hypotest.sequential_test`), for the jobs not setting alpha')
+    parser.add_argument('--loglevel', default='INFO', help='the level of logging, default is INFO')
+    arguments = parser.parse_args(argv)
+    logging.basicConfig(level=arguments.loglevel.upper())
+    if arguments.resume and arguments.output == '-':
+        parser.error('--resume needs an --output file')
+    if arguments.concurrent_jobs < 1:
+        parser.error('--concurrent-jobs must be at least 1')
+
+    if arguments.memory_budget is not None:
+        # the workers read the budget from the environment (see `statdp.core.MEMORY_BUDGET`)
+        os.environ['STATDP_MEMORY_BUDGET'] = str(arguments.memory_budget)
+        import statdp.core
+        statdp.core.MEMORY_BUDGET = arguments.memory_budget
+
+    try:
+        jobs = load_jobs(arguments.job_file)
+        detections = _detections(jobs)
+    except (OSError, ValueError, ImportError) as error:
+        parser.error(str(error))
+    for job in jobs:
+        if arguments.alpha is not None:
+            job['options'].setdefault('alpha', arguments.alpha)
+
+    finished = set()
+    if arguments.resume and os.path.exists(arguments.output):
+        finished = _finished_detections(arguments.output)
+    remaining = [detection for detection in detections if (detection[0]['name'], detection[1]) not in finished]
+    logger.info(f'{len(jobs)} jobs | {len(detections)} detections | {len(detections) - len(remaining)} finished')
+
+    # imported here so that the memory budget is set before the workers are started
+    from statdp.aio import AsyncDetector
+
+    async def run(output_file):
+        async with AsyncDetector(arguments.cores, executor=arguments.executor,
+                                 max_tasks=arguments.max_tasks) as session:
+            return await _run_detections(remaining, session, output_file, arguments.concurrent_jobs)
+
+    start_time = time.perf_counter()
+    if arguments.output == '-':
+        failed = asyncio.run(run(sys.stdout))
+    else:
+        with open(arguments.output, 'a' if arguments.resume else 'w') as output_file:
+            failed = asyncio.run(run(output_file))
+    total_time = time.perf_counter() - start_time
+    logger.info(f'{len(remaining) - failed} detections finished, {failed} failed | Time elapsed: {total_time:5.3f}s')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,6 +25,10 @@ We try to mimic the interfaces of the counterparts in scipy (scipy.stats.hyperge
 However, our implementation is much more efficient thanks to the JIT compiler numba, without loss of too
 much precision. (difference with scipy is < 10^-9, see tests/test_hypergeom.py)
 
+When many values are needed for the same (M, n, N), e.g., when evaluating the test statistics for all events of the
+search space, `ln_factorial_table` computes the log-factorials once, which are then looked up by the `*_table`
+variants instead of being re-computed with lgamma.
+
 References:
 https://en.wikipedia.org/wiki/Hypergeometric_distribution
 https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.hypergeom.html
@@ -37,11 +41,12 @@ ACM Transactions on Mathematical Software (TOMS) 19.1 (1993): 33-43.
 import math
 import logging
 import numba
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
-@numba.njit(numba.float64(numba.int_, numba.int_))
+@numba.njit(cache=True)
 def _ln_binomial(n, k):
     """log of binomial coefficient function (n k), i.e., n choose k"""
     if k > n:
@@ -53,7 +58,7 @@ def _ln_binomial(n, k):
     return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
 
 
-@numba.njit(numba.float64(numba.int_, numba.int_, numba.int_, numba.int_))
+@numba.njit(cache=True)
 def pmf(k, M, n, N):
     """returns the pmf of hypergeometric distribution for given parameters. This interface mimics scipy's hypergeom.pmf
     :param k: input value
@@ -71,22 +76,36 @@ def pmf(k, M, n, N):
     return math.exp(_ln_binomial(n, k) + _ln_binomial(M - n, N - k) - _ln_binomial(M, N))
 
 
-@numba.njit(numba.float64(numba.int_, numba.int_, numba.int_, numba.int_))
-def sf(k, M, n, N):
-    """returns the survival function of hypergeometric distribution for given parameters. This equals (1 - cdf) but we
-    try to be more precise than (1 - cdf). This interface mimics scipy.stats.hypergeom.sf.
-    :param k: input value
-    :param M: the total number of objects
-    :param n: the total number of Type 1 objects
-    :param N: the number of draws
-    :return: the cumulative density for given parameter
+@numba.njit(cache=True)
+def ln_factorial_table(size):
+    """returns the table of log-factorials ln(i!) for i = 0, 1, ..., size
+    :param size: the largest number in the table, should be at least M for the functions using the table
+    :return: numpy array of log-factorials
+    """
+    table = np.empty(size + 1)
+    for i in range(size + 1):
+        table[i] = math.lgamma(i + 1)
+    return table
+
+
+@numba.njit(cache=True)
+def pmf_table(k, M, n, N, ln_factorial):
+    """returns the pmf of hypergeometric distribution, same as `pmf` but with log-factorials looked up in the table.
+    :param ln_factorial: the log-factorial table returned by `ln_factorial_table` with size at least M
     """
     if N > M:
         raise ValueError('The number of draws (N) is larger than the total number of objects (M)')
-    if k >= min(n, N):
-        return 0
-    elif k < 0:
-        return 1
+    if k < 0 or k > n or k > N:
+        return 0.0
+    elif N > M - n and k + M - n < N:
+        return 0.0
+    return math.exp(ln_factorial[n] - ln_factorial[k] - ln_factorial[n - k] +
+                    ln_factorial[M - n] - ln_factorial[N - k] - ln_factorial[M - n - N + k] -
+                    ln_factorial[M] + ln_factorial[N] + ln_factorial[M - N])
+
+
+@numba.njit(cache=True)
+def _sf_recursion(k, M, n, N, start_pmf):
     # calculating the pmf is expensive, use the following recursive definition for performance:
     # P(X=i) = (i / (n - i + 1)) * ((M - n + i - N) / (N - i + 1)) * P(X=i+1)
     # P(X=i) = ((n - i) / (i + 1)) * ((N - i) / (M - n + i + 1 - N)) * P(X=i-1)
@@ -97,17 +116,77 @@ def sf(k, M, n, N):
     # otherwise we use backward recursive definition to calculate P(X <= k) and return 1 - P(x <= k)
     # this also gives use more precise result when pmf(k) ~= 0 since the error will be significant and propagated
     # through the recursion
+    # :start_pmf: is pmf(k + 1) for the forward recursion and pmf(k) for the backward recursion
     if k > N * n / M:
-        pmf_i = pmf(k + 1, M, n, N)
+        pmf_i = start_pmf
         result = pmf_i
         for i in range(k + 1, N):
             pmf_i *= ((n - i) / (i + 1)) * ((N - i) / (M - n + i + 1 - N))
             result += pmf_i
         return result
     else:
-        pmf_i = pmf(k, M, n, N)
+        pmf_i = start_pmf
         result = pmf_i
         for i in range(k, 0, -1):
             pmf_i *= (i / (n - i + 1)) * ((M - n + i - N) / (N - i + 1))
             result += pmf_i
         return 1 - result
+
+
+@numba.njit(cache=True)
+def sf(k, M, n, N):
+    """returns the survival function of hypergeometric distribution for given parameters. This equals (1 - cdf) but we
+    try to be more precise than (1 - cdf). This interface mimics scipy.stats.hypergeom.sf.
+    :param k: input value
+    :param M: the total number of objects
+    :param n: the total number of Type 1 objects
+    :param N: the number of draws
+    :return: the cumulative density for given parameter
+    """
+    if N > M:
+        raise ValueError('The number of draws (N) is larger than the total number of objects (M)')
+    if k >= min(n, N):
+        return 0
+    elif k < 0:
+        return 1
+    return _sf_recursion(k, M, n, N, pmf(k + 1 if k > N * n / M else k, M, n, N))
+
+
+@numba.njit(cache=True)
+def sf_table(k, M, n, N, ln_factorial):
+    """returns the survival function of hypergeometric distribution, same as `sf` but with log-factorials looked up
+    in the table.
+    :param ln_factorial: the log-factorial table returned by `ln_factorial_table` with size at least M
+    """
+    if N > M:
+        raise ValueError('The number of draws (N) is larger than the total number of objects (M)')
+    if k >= min(n, N):
+        return 0.0
+    elif k < 0:
+        return 1.0
+    return _sf_recursion(k, M, n, N, pmf_table(k + 1 if k > N * n / M else k, M, n, N, ln_factorial))
+
+
+@numba.njit(cache=True)
+def sf_normal(k, M, n, N):
+    """returns the normal approximation (with continuity correction) of the survival function of hypergeometric
+    distribution, which takes constant time instead of the O(N) recursion of `sf` and does not underflow for large
+    parameters. The absolute error decreases with the standard deviation
+    sd = sqrt(N (n / M) (1 - n / M) (M - N) / (M - 1)).
+    For n = M / 2 (the case of the test statistics, see tests/test_hypergeom.py) the maximum absolute error is below
+    0.01 / sd, and below 3 * 10^-4 when sd >= 5 (i.e., roughly N >= 100 for large M).
+    :param k: input value
+    :param M: the total number of objects
+    :param n: the total number of Type 1 objects
+    :param N: the number of draws
+    :return: the approximate survival function for given parameter
+    """
+    if N > M:
+        raise ValueError('The number of draws (N) is larger than the total number of objects (M)')
+    if k >= min(n, N):
+        return 0.0
+    elif k < max(0, N - (M - n)):
+        return 1.0
+    mean = N * n / M
+    variance = N * (n / M) * (1 - n / M) * (M - N) / (M - 1)
+    return 0.5 * math.erfc((k + 0.5 - mean) / math.sqrt(2 * variance))
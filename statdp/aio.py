@@ -0,0 +1,209 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Asynchronous front-end to run many detections concurrently on a shared pool of workers, e.g., from a service:
+
+results = await asyncio.gather(adetect_counterexample(noisy_max_v1a, (0.2, 0.7), {'epsilon': 0.7}),
+                               adetect_counterexample(SVT, (0.2, 0.7), {'epsilon': 0.7, 'N': 1, 'T': 0.5}))
+
+The event selection and hypothesis test of each test epsilon are run as plans (see `statdp.core.run_plan`), no thread
+is dedicated to a detection: the event loop awaits the block tasks of a plan, and the steps in between (merging the
+counts and computing the test statistics) run in the default executor of the loop, so they do not block it. The block
+tasks of all detections go through one scheduler, which keeps at most max_tasks of them on the workers and takes the
+next task from the detections in turn, so that a long detection does not hold up the others.
+"""
+import asyncio
+import collections
+import logging
+import os
+
+from statdp.core import submit_task
+from statdp.detector import Detector, _prepare_detection, _detect_epsilon_plan
+from statdp.generators import ALL_DIFFER
+from statdp.selectors import _sample_events_plan
+
+logger = logging.getLogger(__name__)
+
+
+def _step(plan, results):
+    # advance the plan with the results of its tasks (None to start it), StopIteration cannot be raised from a future
+    try:
+        return False, next(plan) if results is None else plan.send(results)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+class _FairScheduler:
+    """ Run the tasks of the jobs on the executor with at most :max_tasks: tasks running at the same time, the waiting
+    tasks are started in round-robin order of their jobs. All methods must be called from the event loop thread. """
+
+    def __init__(self, executor, max_tasks):
+        self._executor = executor
+        self._max_tasks = max_tasks
+        # job -> deque of (function, task, asyncio future) waiting to start, in the round-robin order of the jobs
+        self._waiting = collections.OrderedDict()
+        self._running = 0
+
+    def submit(self, job, function, task):
+        """ Schedule function(task) for :job:, cancelling the returned asyncio future withdraws the task if it has not
+        started yet. """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(job, collections.deque()).append((function, task, future))
+        self._dispatch()
+        return future
+
+    def cancel(self, job):
+        """ Cancel all waiting tasks of :job:. """
+        for _, _, future in self._waiting.pop(job, ()):
+            future.cancel()
+
+    def _dispatch(self):
+        while self._running < self._max_tasks and self._waiting:
+            job, queue = next(iter(self._waiting.items()))
+            function, task, future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(job)
+            else:
+                del self._waiting[job]
+            if future.cancelled():
+                continue
+            self._running += 1
+            self._start(function, task, future)
+
+    def _start(self, function, task, future):
+        loop = future.get_loop()
+        work = submit_task(self._executor, function, task)
+        work.add_done_callback(lambda work: loop.call_soon_threadsafe(self._finish, work, future))
+
+    def _finish(self, work, future):
+        self._running -= 1
+        # the result of a task whose job has been cancelled meanwhile is dropped
+        if not future.cancelled():
+            if work.cancelled():
+                future.cancel()
+            elif work.exception() is not None:
+                future.set_exception(work.exception())
+            else:
+                future.set_result(work.result())
+        self._dispatch()
+
+
+class AsyncDetector:
+    """ An asynchronous detection session, the detections awaited at the same time share the workers of the session
+    fairly (see `statdp.aio`). The session should be closed after use, e.g., with `async with AsyncDetector() as ...`.
+    """
+
+    def __init__(self, cores=None, executor='process', max_tasks=None):
+        """
+        :param cores: The number of max workers for the process / thread pool, os.cpu_count() is used if None.
+        :param executor: The workers to run the algorithm with, see `Detector`, except that 'serial' is not supported.
+        :param max_tasks: The maximum number of block tasks of all detections on the workers at the same time, 2 tasks
+        per worker by default so that the workers are not left idle between the tasks.
+        """
+        if executor == 'serial':
+            raise ValueError("the asynchronous detection needs workers, executor cannot be 'serial'")
+        self._detector = Detector(cores, executor=executor)
+        self.max_tasks = max_tasks if max_tasks is not None else 2 * (cores if cores else os.cpu_count())
+        self._scheduler = _FairScheduler(self._detector.executor, self.max_tasks)
+
+    async def detect(self, algorithm, test_epsilon, default_kwargs=None, databases=None, num_input=(5, 10),
+                     event_iterations=100000, detect_iterations=500000, sensitivity=ALL_DIFFER, reuse_samples=False,
+                     seed=None, alpha=None, adaptive_selection=False):
+        """ Run a detection on the workers of the session, see `detect_counterexample` for the parameters. The test
+        epsilons are processed at the same time and the results are the same as those of `Detector.detect` with the
+        same seed. Cancelling the detection withdraws its tasks not yet started, the running ones are left to finish
+        and their results are dropped.
+        :return: [(epsilon, p, d1, d2, kwargs, event)] see `Detector.detect`.
+        """
+        if reuse_samples and adaptive_selection:
+            raise ValueError('reuse_samples cannot be used with adaptive_selection, which samples for each epsilon')
+        default_kwargs = default_kwargs if default_kwargs else {}
+        logger.info(f'Start asynchronous detection for counterexample on {algorithm.__name__} with test epsilon '
+                    f'{test_epsilon}')
+
+        input_list, test_epsilon, sample_seed, epsilon_seeds = _prepare_detection(
+            algorithm, test_epsilon, default_kwargs, databases, num_input, sensitivity, seed)
+        # each detection is a job of the scheduler, its tasks take turns with those of the other detections
+        job = object()
+        detections = []
+        try:
+            samples = await self._run(job, _sample_events_plan(
+                algorithm, input_list, event_iterations, coverage=0.7, num_thresholds=10,
+                seed=sample_seed)) if reuse_samples else None
+            detections = [asyncio.ensure_future(self._run(job, _detect_epsilon_plan(
+                algorithm, input_list, epsilon, seeds, event_iterations, detect_iterations, samples, alpha,
+                adaptive_selection))) for epsilon, seeds in zip(test_epsilon, epsilon_seeds)]
+            results = await asyncio.gather(*detections)
+        finally:
+            # stop the other test epsilons if one fails or the detection is cancelled
+            for detection in detections:
+                detection.cancel()
+            self._scheduler.cancel(job)
+
+        for epsilon, p, d1, d2, kwargs, event, *_ in results:
+            logger.info(f'Epsilon: {epsilon} | p-value: {p:5.3f} | Event: {event}')
+            logger.debug(f'D1: {d1} | D2: {d2} | kwargs: {kwargs}')
+        return list(results)
+
+    async def _run(self, job, plan):
+        # the asynchronous counterpart of `statdp.core.run_plan`, the steps of the plan are CPU-heavy and run off the
+        # event loop thread
+        loop = asyncio.get_running_loop()
+        done, value = await loop.run_in_executor(None, _step, plan, None)
+        while not done:
+            function, tasks = value
+            results = await asyncio.gather(*(self._scheduler.submit(job, function, task) for task in tasks))
+            done, value = await loop.run_in_executor(None, _step, plan, list(results))
+        return value
+
+    def close(self):
+        """ Wait for the workers to finish and shut down the pool, if it is created by the session. """
+        self._detector.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._detector.__exit__(exc_type, exc_value, traceback)
+
+
+_default_session = None
+
+
+async def adetect_counterexample(algorithm, test_epsilon, default_kwargs=None, databases=None, num_input=(5, 10),
+                                 event_iterations=100000, detect_iterations=500000, sensitivity=ALL_DIFFER,
+                                 reuse_samples=False, seed=None, alpha=None, adaptive_selection=False, session=None):
+    """ The asynchronous version of `detect_counterexample`, the detections awaited at the same time share the
+    workers of :session: fairly. See `detect_counterexample` for the other parameters.
+    :param session: The `AsyncDetector` to run the detection with, a default session (with a process pool of
+    os.cpu_count() workers) shared by all calls without a session is created on first use.
+    :return: [(epsilon, p, d1, d2, kwargs, event)] see `detect_counterexample`.
+    """
+    global _default_session
+    if session is None:
+        if _default_session is None:
+            _default_session = AsyncDetector()
+        session = _default_session
+    return await session.detect(algorithm, test_epsilon, default_kwargs=default_kwargs, databases=databases,
+                                num_input=num_input, event_iterations=event_iterations,
+                                detect_iterations=detect_iterations, sensitivity=sensitivity,
+                                reuse_samples=reuse_samples, seed=seed, alpha=alpha,
+                                adaptive_selection=adaptive_selection)
@@ -21,6 +21,7 @@
 # SOFTWARE.
 from itertools import zip_longest
 
+import numba
 import numpy as np
 
 
@@ -29,34 +30,45 @@ def _hamming_distance(result1, result2):
     return sum(res1 != res2 for res1, res2 in zip_longest(result1, result2))
 
 
-def noisy_max_v1a(prng, queries, epsilon):
+def _noise_shape(queries, size):
+    # batched algorithms draw a (size, len(queries)) noise matrix, one row per run, mimicking numpy's `size` convention
+    return len(queries) if size is None else (size, len(queries))
+
+
+def noisy_max_v1a(prng, queries, epsilon, size=None):
     # find the largest noisy element and return its index
-    return (np.asarray(queries, dtype=np.float64) + prng.laplace(scale=2.0 / epsilon, size=len(queries))).argmax()
+    return (np.asarray(queries, dtype=np.float64) +
+            prng.laplace(scale=2.0 / epsilon, size=_noise_shape(queries, size))).argmax(axis=-1)
 
 
-def noisy_max_v1b(prng, queries, epsilon):
+def noisy_max_v1b(prng, queries, epsilon, size=None):
     # INCORRECT: returning maximum value instead of the index
-    return (np.asarray(queries, dtype=np.float64) + prng.laplace(scale=2.0 / epsilon, size=len(queries))).max()
+    return (np.asarray(queries, dtype=np.float64) +
+            prng.laplace(scale=2.0 / epsilon, size=_noise_shape(queries, size))).max(axis=-1)
 
 
-def noisy_max_v2a(prng, queries, epsilon):
-    return (np.asarray(queries, dtype=np.float64) + prng.exponential(scale=2.0 / epsilon, size=len(queries))).argmax()
+def noisy_max_v2a(prng, queries, epsilon, size=None):
+    return (np.asarray(queries, dtype=np.float64) +
+            prng.exponential(scale=2.0 / epsilon, size=_noise_shape(queries, size))).argmax(axis=-1)
 
 
-def noisy_max_v2b(prng, queries, epsilon):
+def noisy_max_v2b(prng, queries, epsilon, size=None):
     # INCORRECT: returning the maximum value instead of the index
-    return (np.asarray(queries, dtype=np.float64) + prng.exponential(scale=2.0 / epsilon, size=len(queries))).max()
+    return (np.asarray(queries, dtype=np.float64) +
+            prng.exponential(scale=2.0 / epsilon, size=_noise_shape(queries, size))).max(axis=-1)
 
 
-def histogram_eps(prng, queries, epsilon):
+def histogram_eps(prng, queries, epsilon, size=None):
     # INCORRECT: using (epsilon) noise instead of (1 / epsilon)
-    noisy_array = np.asarray(queries, dtype=np.float64) + prng.laplace(scale=epsilon, size=len(queries))
-    return noisy_array[0]
+    noisy_array = np.asarray(queries, dtype=np.float64) + prng.laplace(scale=epsilon, size=_noise_shape(queries, size))
+    # transpose so that the first noisy query of every run is selected for batched runs
+    return noisy_array.T[0]
 
 
-def histogram(prng, queries, epsilon):
-    noisy_array = np.asarray(queries, dtype=np.float64) + prng.laplace(scale=1.0 / epsilon, size=len(queries))
-    return noisy_array[0]
+def histogram(prng, queries, epsilon, size=None):
+    noisy_array = np.asarray(queries, dtype=np.float64) + \
+                  prng.laplace(scale=1.0 / epsilon, size=_noise_shape(queries, size))
+    return noisy_array.T[0]
 
 
 def SVT(prng, queries, epsilon, N, T):
@@ -145,3 +157,93 @@ def iSVT4(prng, queries, epsilon, N, T):
         else:
             out.append(False)
     return out.count(False), out[-1]
+
+
+# numba-compiled versions of the SVT family, statdp runs them in a compiled sampling loop (see `statdp.core`). The
+# queries are passed as numpy arrays, and the output lists are replaced by counters as the lists would hold mixed types.
+@numba.njit(cache=True)
+def _hamming_distance_numba(out, length, queries_length):
+    # hamming distance between out[:length] and the reference [True] * (queries_length / 2) + [False] * ..., the
+    # missing outputs of an early stop are counted as different
+    distance = queries_length - length
+    true_count = int(queries_length / 2)
+    for i in range(length):
+        distance += out[i] != (i < true_count)
+    return distance
+
+
+@numba.njit(cache=True)
+def SVT_numba(prng, queries, epsilon, N, T):
+    eta1 = prng.laplace(0.0, 2.0 / epsilon)
+    noisy_T = T + eta1
+    c1, false_count = 0, 0
+    for query in queries:
+        eta2 = prng.laplace(0.0, 4.0 * N / epsilon)
+        if query + eta2 >= noisy_T:
+            c1 += 1
+            if c1 >= N:
+                break
+        else:
+            false_count += 1
+    return false_count
+
+
+@numba.njit(cache=True)
+def iSVT1_numba(prng, queries, epsilon, N, T):
+    out = np.empty(len(queries), dtype=np.bool_)
+    eta1 = prng.laplace(0.0, 2.0 / epsilon)
+    noisy_T = T + eta1
+    for i in range(len(queries)):
+        # INCORRECT: no noise added to the queries
+        out[i] = queries[i] >= noisy_T
+    return _hamming_distance_numba(out, len(queries), len(queries))
+
+
+@numba.njit(cache=True)
+def iSVT2_numba(prng, queries, epsilon, N, T):
+    out = np.empty(len(queries), dtype=np.bool_)
+    eta1 = prng.laplace(0.0, 2.0 / epsilon)
+    noisy_T = T + eta1
+    for i in range(len(queries)):
+        # INCORRECT: noise added to queries doesn't scale with N
+        eta2 = prng.laplace(0.0, 2.0 / epsilon)
+        # INCORRECT: no bounds on the True's to output
+        out[i] = queries[i] + eta2 >= noisy_T
+    return _hamming_distance_numba(out, len(queries), len(queries))
+
+
+@numba.njit(cache=True)
+def iSVT3_numba(prng, queries, epsilon, N, T):
+    out = np.empty(len(queries), dtype=np.bool_)
+    eta1 = prng.laplace(0.0, 4.0 / epsilon)
+    noisy_T = T + eta1
+    c1, length = 0, 0
+    for i in range(len(queries)):
+        # INCORRECT: noise added to queries doesn't scale with N
+        eta2 = prng.laplace(0.0, 4.0 / (3.0 * epsilon))
+        out[i] = queries[i] + eta2 > noisy_T
+        length += 1
+        if out[i]:
+            c1 += 1
+            if c1 >= N:
+                break
+    return _hamming_distance_numba(out, length, len(queries))
+
+
+@numba.njit(cache=True)
+def iSVT4_numba(prng, queries, epsilon, N, T):
+    eta1 = prng.laplace(0.0, 2.0 / epsilon)
+    noisy_T = T + eta1
+    c1, false_count, last = 0, 0, 0.0
+    for query in queries:
+        eta2 = prng.laplace(0.0, 2.0 * N / epsilon)
+        if query + eta2 > noisy_T:
+            # INCORRECT: Output the noisy query instead of True
+            last = query + eta2
+            c1 += 1
+            if c1 >= N:
+                break
+        else:
+            last = 0.0
+            false_count += 1
+    return false_count, last
@@ -19,28 +19,633 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import math
+import concurrent.futures
+import functools
+import inspect
 import itertools
 import logging
+import os
+import time
 import numpy as np
+import numba
+from numba.core import types
+from numba.extending import is_jitted, overload
 
 logger = logging.getLogger(__name__)
 
 
-def run_algorithm(algorithm, d1, d2, kwargs, event, total_iterations):
+# the iterations of a test are run in blocks of this size, each block draws from its own child seed (see `spawn_seeds`),
+# so that the results for a seed do not depend on how the blocks are distributed to the processes
+BLOCK_SIZE = 10000
+
+# the search space is generated from the outputs of the first SEARCH_SPACE_ITERATIONS iterations (or all of them if
+# fewer), independent of the memory budget (see `_run_pieces`)
+SEARCH_SPACE_ITERATIONS = BLOCK_SIZE
+
+# the default memory budget (in bytes) of the output buffers of `count_events`, about 1e6 iterations of an algorithm
+# returning one float, can be set for all processes (e.g., the workers) with the STATDP_MEMORY_BUDGET environment
+# variable
+MEMORY_BUDGET = int(os.environ.get('STATDP_MEMORY_BUDGET', 2 ** 24))
+
+
+def spawn_seeds(seed, number):
+    """ Derive independent child seeds from the given seed with np.random.SeedSequence.spawn.
+    :param seed: The seed, can be None (fresh entropy from the OS), an int or a np.random.SeedSequence.
+    :param number: The number of child seeds to derive.
+    :return: list of np.random.SeedSequence
+    """
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed.spawn(number)
+
+
+# the types of the loc / scale arguments whose draws `BufferedGenerator` serves from its buffers
+_SCALAR_TYPES = frozenset((float, int, np.float64))
+
+
+class BufferedGenerator:
+    """ A wrapper of np.random.Generator for algorithms drawing one number at a time (see `buffered_draws`), e.g.,
+    `prng.laplace(scale=2.0 / epsilon)` for each query: the scalar laplace / exponential / normal draws are served from
+    buffers of standard variates drawn in bulk, and scaled / shifted per call, which saves the overhead of a Generator
+    call per draw. The draws follow the same distributions and are reproducible from the seed of the generator, though
+    not identical to the draws of the generator itself. All other calls (and draws with a size or array arguments) are
+    passed on to the generator.
+    """
+
+    def __init__(self, generator, buffer_size=8192):
+        """
+        :param generator: The np.random.Generator to draw from.
+        :param buffer_size: The number of standard variates drawn at a time for each distribution.
+        """
+        self.generator = generator
+        self.buffer_size = buffer_size
+        # the standard variates to serve for each distribution, the lists are consumed from the end
+        self._laplace, self._exponential, self._normal = [], [], []
+
+    def __getattr__(self, name):
+        return getattr(self.generator, name)
+
+    def _refill(self, buffer, distribution):
+        buffer.extend(getattr(self.generator, distribution)(size=self.buffer_size).tolist())
+
+    # the checks are kept inline since they run for every draw, the draws with a size, array arguments or an invalid
+    # scale (which raises the error of the generator) are passed on to the generator
+    def laplace(self, loc=0.0, scale=1.0, size=None):
+        if size is None and type(loc) in _SCALAR_TYPES and type(scale) in _SCALAR_TYPES and scale >= 0:
+            if not self._laplace:
+                self._refill(self._laplace, 'laplace')
+            return loc + scale * self._laplace.pop()
+        return self.generator.laplace(loc, scale, size)
+
+    def exponential(self, scale=1.0, size=None):
+        if size is None and type(scale) in _SCALAR_TYPES and scale >= 0:
+            if not self._exponential:
+                self._refill(self._exponential, 'standard_exponential')
+            return scale * self._exponential.pop()
+        return self.generator.exponential(scale, size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        if size is None and type(loc) in _SCALAR_TYPES and type(scale) in _SCALAR_TYPES and scale >= 0:
+            if not self._normal:
+                self._refill(self._normal, 'standard_normal')
+            return loc + scale * self._normal.pop()
+        return self.generator.normal(loc, scale, size)
+
+
+def map_unordered(executor, function, iterable):
+    """ Apply the function to each item with the executor and yield the results as they complete.
+    :param executor: A multiprocessing.Pool(), a concurrent.futures.Executor (e.g., a ThreadPoolExecutor), or None to
+    run the function in the current process.
+    :param function: The function to apply, it must be picklable for process based executors.
+    :param iterable: The items to apply the function to.
+    :return: generator of the results, in the order of completion.
+    """
+    if executor is None:
+        yield from map(function, iterable)
+    elif isinstance(executor, concurrent.futures.Executor):
+        futures = [executor.submit(function, item) for item in iterable]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+    else:
+        yield from executor.imap_unordered(function, iterable)
+
+
+def submit_task(executor, function, item):
+    """ Submit function(item) to the executor.
+    :param executor: A multiprocessing.Pool(), a concurrent.futures.Executor, or None to run the function right away in
+    the current process.
+    :param function: The function to apply, it must be picklable for process based executors.
+    :param item: The item to apply the function to.
+    :return: concurrent.futures.Future of the result.
+    """
+    if isinstance(executor, concurrent.futures.Executor):
+        return executor.submit(function, item)
+    future = concurrent.futures.Future()
+    future.set_running_or_notify_cancel()
+    if executor is None:
+        try:
+            future.set_result(function(item))
+        except Exception as error:
+            future.set_exception(error)
+    else:
+        # multiprocessing.Pool reports the outcome with callbacks from its result handler thread
+        executor.apply_async(function, (item, ), callback=future.set_result, error_callback=future.set_exception)
+    return future
+
+
+def run_plan(plan, executor, progress=None):
+    """ Run a plan with the executor. A plan is a generator which yields batches of (function, [task, ...]) and is
+    sent back the list of results (in the order of completion) of each batch, the value it returns is returned. The
+    same plan can be run by other drivers, e.g., the asynchronous one in `statdp.aio`.
+    :param plan: The plan generator.
+    :param executor: The executor to run the tasks with, see `map_unordered`.
+    :param progress: A tqdm progress bar to update for each completed task, optional.
+    :return: The return value of the plan.
+    """
+    try:
+        function, tasks = next(plan)
+        while True:
+            results = []
+            for result in map_unordered(executor, function, tasks):
+                results.append(result)
+                if progress is not None:
+                    progress.update()
+            function, tasks = plan.send(results)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _timed(function, task):
+    start = time.perf_counter()
+    result = function(task)
+    return result, time.perf_counter() - start
+
+
+class _PlanState:
+    # a plan run by `run_plans` and the results of its current batch
+    def __init__(self, index, plan):
+        self.index, self.plan = index, plan
+        self.results, self.size = [], 0
+
+
+def _advance_plan(state, value, executor, pending):
+    # send the results of the last batch to the plan and submit the tasks of its next batch, returns (finished, value)
+    while True:
+        try:
+            function, tasks = state.plan.send(value)
+        except StopIteration as stop:
+            return True, stop.value
+        if tasks:
+            break
+        value = []
+    state.results, state.size = [], len(tasks)
+    timed = functools.partial(_timed, function)
+    for task in tasks:
+        pending[submit_task(executor, timed, task)] = state
+    return False, None
+
+
+def run_plans(plans, executor, window=1, task_times=None):
+    """ Run several plans (see `run_plan`) at the same time with the executor, in a pipeline: the tasks of all running
+    plans are queued on the executor together, so that while a plan is advanced in the current process (e.g., to
+    compute the p-values of its samples), or waits for the last tasks of its batch, the workers run the tasks of the
+    other plans.
+    :param plans: Iterable of the plan generators, which are started in order.
+    :param executor: The executor to run the tasks with, see `submit_task`.
+    :param window: The maximum number of plans running at the same time.
+    :param task_times: A list to append the run time (in seconds) of each task to, optional, e.g., to compute the
+    utilization of the workers.
+    :return: generator of (index of the plan, return value of the plan), in the order of completion. Closing the
+    generator cancels the tasks not started yet.
+    """
+    plans = enumerate(plans)
+    pending, running, exhausted = {}, 0, False
+    try:
+        while True:
+            # start the next plans to fill the window
+            while running < window and not exhausted:
+                started = next(plans, None)
+                if started is None:
+                    exhausted = True
+                    break
+                state = _PlanState(*started)
+                running += 1
+                finished, value = _advance_plan(state, None, executor, pending)
+                if finished:
+                    running -= 1
+                    yield state.index, value
+            if not pending:
+                return
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                state = pending.pop(future)
+                result, elapsed = future.result()
+                if task_times is not None:
+                    task_times.append(elapsed)
+                state.results.append(result)
+                if len(state.results) == state.size:
+                    finished, value = _advance_plan(state, state.results, executor, pending)
+                    if finished:
+                        running -= 1
+                        yield state.index, value
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def split_iterations(iterations, block_size=BLOCK_SIZE):
+    """ Split the iterations into blocks of :block_size: iterations, the last block holds the remaining iterations.
+    :param iterations: The total iterations to split.
+    :param block_size: The iterations of each block.
+    :return: list of the iterations of each block.
+    """
+    blocks = [block_size] * (iterations // block_size)
+    return blocks + [iterations % block_size] if iterations % block_size else blocks
+
+
+def buffered_draws(algorithm):
+    """ Opt the algorithm in to buffered draws: it then gets a `BufferedGenerator` instead of the np.random.Generator,
+    which serves its scalar draws from buffers. Only for algorithms running in python that use the generator through
+    its methods, e.g., not passing it to numba-compiled helpers or checking its type. Can be used as a decorator.
+    :param algorithm: The algorithm to opt in.
+    :return: The algorithm.
+    """
+    algorithm.buffered_draws = True
+    return algorithm
+
+
+def is_batched(algorithm):
+    """ Check if the algorithm supports the batched protocol, i.e., it declares a `size` argument (like the
+    distributions in numpy.random.Generator) and returns an array of outputs (or a tuple / list of arrays for multiple
+    return values) for `size` independent runs at once, instead of the output of one single run.
+    :param algorithm: The algorithm to check.
+    :return: True if the algorithm takes a `size` argument, False otherwise.
+    """
+    try:
+        return 'size' in inspect.signature(algorithm).parameters
+    except (TypeError, ValueError):
+        # signature is not available for some builtin / extension callables, treat them as non-batched
+        return False
+
+
+def _run_batched(algorithm, prng, database, kwargs, iterations):
+    """ Run the batched algorithm for :iterations: times in a single call.
+    :return: list of numpy arrays, each containing the outputs of one return value.
+    """
+    output = algorithm(prng, database, size=iterations, **kwargs)
+    result = [np.asarray(row) for row in output] if isinstance(output, (tuple, list)) else [np.asarray(output)]
+    for row in result:
+        if row.shape != (iterations,):
+            raise ValueError(f'Batched algorithm should return outputs of shape ({iterations},), got {row.shape}')
+    return result
+
+
+def _store(outputs, index, result):
+    # stores the (tuple of) return value(s) at :index: of the output arrays, see the overload below
+    pass
+
+
+@overload(_store)
+def _store_overload(outputs, index, result):
+    # the return values of a tuple can have different types, therefore they are stored one by one by recursing on the
+    # rest of the tuple, which numba resolves at compile time
+    if isinstance(result, types.BaseTuple):
+        if len(result) == 0:
+            return lambda outputs, index, result: None
+
+        def store_tuple(outputs, index, result):
+            outputs[0][index] = result[0]
+            _store(outputs[1:], index, result[1:])
+        return store_tuple
+
+    def store_value(outputs, index, result):
+        outputs[0][index] = result
+    return store_value
+
+
+# the loop does not touch python objects, so the GIL is released for thread based executors
+@numba.njit(nogil=True, cache=True)
+def _compiled_loop(algorithm, prng, database, args, outputs):
+    for index in range(outputs[0].shape[0]):
+        _store(outputs, index, algorithm(prng, database, *args))
+
+
+def _run_compiled(algorithm, prng, database, kwargs, outputs):
+    """ Run the numba-compiled algorithm in a compiled loop, which calls the algorithm directly with the numba version
+    of the random generator and writes the outputs into the given arrays, one run for each element.
+    :return: list of the output arrays, each containing the outputs of one return value.
+    """
+    # the compiled loop cannot pass keyword arguments, bind them to their positions
+    arguments = inspect.signature(algorithm.py_func).bind(prng, database, **kwargs)
+    arguments.apply_defaults()
+    _compiled_loop(algorithm, prng, database, arguments.args[2:], tuple(outputs))
+    return list(outputs)
+
+
+def _piece_iterations(dtypes, memory_budget):
+    # the number of iterations whose outputs of d1 and d2 fit in the memory budget
+    return max(memory_budget // (2 * max(sum(np.dtype(dtype).itemsize for dtype in dtypes), 1)), 1)
+
+
+def _is_categorical(component):
+    # an event component is either a single value (categorical) or an (lower, upper) open interval
+    return np.issubdtype(type(component), np.number)
+
+
+def _component_bounds(component):
+    # returns (lower, upper, lower_side, upper_side) so that the number of outputs in the component equals
+    # searchsorted(upper, upper_side) - searchsorted(lower, lower_side) on the sorted outputs
+    if _is_categorical(component):
+        return component, component, 'left', 'right'
+    lower, upper = component
+    return lower, upper, 'right', 'left'
+
+
+def _bin_columns(columns, components):
+    """ Assign each output to an "atom" defined by the boundaries (single values and interval endpoints) of the given
+    event components. With sorted boundaries b_0 < b_1 < ... < b_(m-1), atom 2i + 1 contains the outputs equal to b_i
+    and atom 2i contains the outputs strictly between b_(i-1) and b_i, therefore every component covers a contiguous
+    range of atoms. Outputs that are not comparable (NaN) fall into atom 2m which no component covers.
+    :param columns: The columns of outputs of the same return value to bin, e.g., the outputs of d1 and d2.
+    :return: ([atoms of each column], number of atoms, [(first_atom, last_atom) for each component])
+    """
+    boundaries = np.unique(np.asarray(
+        [value for component in components for value in ((component, ) if _is_categorical(component) else component)],
+        dtype=np.float64))
+
+    def to_atoms(column):
+        # left and right insertion points differ by one only if the output equals one of the boundaries
+        return np.searchsorted(boundaries, column, side='left') + np.searchsorted(boundaries, column, side='right')
+
+    atom_ranges = []
+    for component in components:
+        lower, upper, _, _ = _component_bounds(component)
+        first, last = (int(np.searchsorted(boundaries, bound)) for bound in (lower, upper))
+        # a single value covers only its own atom, (lower, upper) excludes both endpoints and an empty interval has
+        # last_atom < first_atom
+        atom_ranges.append((2 * first + 1, 2 * last + 1) if _is_categorical(component) else (2 * first + 2, 2 * last))
+    return [to_atoms(column) for column in columns], 2 * len(boundaries) + 1, atom_ranges
+
+
+def _box_sums(histograms, boxes):
+    """ Sum up the histograms over each box with their prefix sums (summed-area tables): the sum over a box is read
+    off from its 2^d corners by inclusion-exclusion, so the cost of an event does not depend on the number of atoms
+    it covers.
+    :param histograms: The (number of histograms, *dimensions) array of the histograms to sum up.
+    :param boxes: The (number of boxes, d, 2) array of the (first, last) atoms of each box on each dimension, a box is
+    empty if last < first on any dimension.
+    :return: The (number of histograms, number of boxes) array of the sums.
+    """
+    dimensions = histograms.shape[1:]
+    # prefix[..., i_1, ..., i_d] is the sum of histograms[..., :i_1, ..., :i_d]
+    prefix = np.zeros((len(histograms), *(dimension + 1 for dimension in dimensions)), dtype=np.int64)
+    prefix[(slice(None), ) + (slice(1, None), ) * len(dimensions)] = histograms
+    for axis in range(1, len(dimensions) + 1):
+        np.cumsum(prefix, axis=axis, out=prefix)
+
+    firsts = boxes[:, :, 0]
+    # an empty range starts and ends at the same prefix, so that its box sums up to zero
+    ends = np.maximum(boxes[:, :, 1] + 1, firsts)
+    sums = np.zeros((len(histograms), len(boxes)), dtype=np.int64)
+    for corner in itertools.product((False, True), repeat=len(dimensions)):
+        sign = -1 if (len(dimensions) - sum(corner)) % 2 else 1
+        sums += sign * prefix[(slice(None), ) + tuple(np.where(corner, ends, firsts).T)]
+    return sums
+
+
+def _joint_counts(samples, events, min_count=None):
+    """ Count the outputs falling into each event of multiple return values jointly: each return value is binned once
+    (see `_bin_columns`), the joint histogram of the bins is built in one pass and the count of each event is read off
+    from its prefix sums (see `_box_sums`).
+    :param samples: The (outputs, weights) of each count, e.g., ((result_d1, None), (result_d2, None)), each return
+    value is stored as a row of the outputs and each output is counted :weights: times (once if None).
+    :param events: The events to count, each event has a component for each return value.
+    :param min_count: If given, the components whose marginal count (the total over all samples of the outputs
+    falling into the component) is at most :min_count: are pruned, along with the events containing them, before
+    the events are counted jointly.
+    :return: (events, [(count of each sample), ...]) The remaining events along with their counts.
+    """
+    events = tuple(events)
+    if min_count is not None:
+        surviving_components = []
+        for row in range(len(events[0]) if events else 0):
+            components = tuple(dict.fromkeys(event[row] for event in events))
+            atoms, atom_number, atom_ranges = _bin_columns([outputs[row] for outputs, _ in samples], components)
+            marginal = np.zeros(atom_number + 1, dtype=np.int64)
+            for row_atoms, (_, weights) in zip(atoms, samples):
+                marginal[1:] += np.bincount(row_atoms, weights=weights, minlength=atom_number).astype(np.int64)
+            marginal = np.cumsum(marginal)
+            surviving_components.append({component for component, (first, last) in zip(components, atom_ranges)
+                                         if marginal[max(last + 1, first)] - marginal[first] > min_count})
+        # the joint count of an event is at most the marginal count of each of its components
+        events = tuple(event for event in events
+                       if all(component in surviving_components[row] for row, component in enumerate(event)))
+    if not events:
+        return events, []
+
+    sample_atoms, dimensions, boxes = [[] for _ in samples], [], []
+    for row in range(len(events[0])):
+        # the components are kept in their order of appearance so the atom ranges can be looked up by component
+        components = tuple(dict.fromkeys(event[row] for event in events))
+        atoms, atom_number, atom_ranges = _bin_columns([outputs[row] for outputs, _ in samples], components)
+        for atom_list, row_atoms in zip(sample_atoms, atoms):
+            atom_list.append(row_atoms)
+        dimensions.append(atom_number)
+        atom_ranges = dict(zip(components, atom_ranges))
+        boxes.append([atom_ranges[event[row]] for event in events])
+
+    histograms = np.stack([np.bincount(np.ravel_multi_index(atoms, dimensions), weights=weights,
+                                       minlength=int(np.prod(dimensions))).astype(np.int64).reshape(dimensions)
+                           for atoms, (_, weights) in zip(sample_atoms, samples)])
+    counts = _box_sums(histograms, np.asarray(boxes, dtype=np.int64).transpose(1, 0, 2))
+    return events, [tuple(int(count) for count in event_counts) for event_counts in counts.T]
+
+
+def _count_outputs(result_d1, result_d2, events):
+    """ Count the number of outputs falling into each event. Instead of checking every event against the full output
+    arrays, the outputs are sorted (or binned) once and the counts of all events are read off from them.
+    :param result_d1: The outputs of d1, each return value is stored as a row.
+    :param result_d2: The outputs of d2, each return value is stored as a row.
+    :param events: The events to count, each event has a component for each return value.
+    :return: [(cx, cy), ...] The counts of d1 / d2 for each event.
+    """
+    if len(result_d1) == 1:
+        # a single return value: sort the outputs once and count each event with two binary searches
+        counts = []
+        sorted_results = np.sort(result_d1[0]), np.sort(result_d2[0])
+        for (component, ) in events:
+            lower, upper, lower_side, upper_side = _component_bounds(component)
+            counts.append(tuple(
+                max(int(np.searchsorted(result, upper, side=upper_side) -
+                        np.searchsorted(result, lower, side=lower_side)), 0) for result in sorted_results))
+        return counts
+
+    # multiple return values: count the events jointly on the histogram of the bins
+    return _joint_counts(((result_d1, None), (result_d2, None)), events)[1]
+
+
+def _densest_range(sorted_result, coverage):
+    """ Find the narrowest range [sorted_result[search_min], sorted_result[search_max]] which covers :coverage: of the
+    sorted outputs, the widths of all candidate ranges are computed at once with one array subtraction.
+    :return: (search_min, search_max) The indices of the range boundaries.
+    """
+    # coverage of 1 means the whole range of the outputs
+    search_range = min(int(coverage * len(sorted_result)), len(sorted_result) - 1)
+    widths = sorted_result[search_range:] - sorted_result[:len(sorted_result) - search_range]
+    # NaN widths (from NaN or infinite outputs) should never be picked as the narrowest range
+    search_max = search_range + int(np.argmin(np.where(np.isnan(widths), np.inf, widths)))
+    return search_max - search_range, search_max
+
+
+def _generate_search_space(result_d1, result_d2, coverage, num_thresholds, total_iterations=None):
+    """ Determine the event search space for each return value based on the outputs.
+    :param result_d1: The outputs of d1, each return value is stored as a row.
+    :param result_d2: The outputs of d2, each return value is stored as a row.
+    :param coverage: The fraction of the outputs the densest range of continuous outputs should cover.
+    :param num_thresholds: The number of thresholds (alpha of (-inf, alpha) events) for continuous outputs.
+    :param total_iterations: The iterations of the whole run the outputs are the first part of, a return value with
+    fewer than 0.2% of them distinct values is categorical. The number of outputs is used if None.
+    :return: [(event, ...), ...] The events for each return value.
+    """
+    event_search_space = []
+    for row in range(len(result_d1)):
+        iterations = len(result_d1[row]) if total_iterations is None else max(total_iterations, len(result_d1[row]))
+        combined_result = np.sort(np.concatenate((result_d1[row], result_d2[row])))
+        # the outputs are sorted, so the unique values are the ones different from their predecessors
+        unique = combined_result[np.concatenate(((True, ), combined_result[1:] != combined_result[:-1]))]
+
+        # categorical output
+        if len(unique) < iterations * 0.002:
+            event_search_space.append(tuple(int(key) for key in unique))
+        else:
+            search_min, search_max = _densest_range(combined_result, coverage)
+            event_search_space.append(
+                tuple((-float('inf'), float(alpha)) for alpha in
+                      np.linspace(combined_result[search_min], combined_result[search_max], num=num_thresholds)))
+    return event_search_space
+
+
+def _possible_events(result_d1, result_d2, event, coverage, num_thresholds, total_iterations=None):
+    """ Return the events to count: the given :event:, or the events of the search space generated from the outputs if
+    :event: is None (see `_generate_search_space` for :total_iterations:). """
+    # get desired search space for each return value
+    if event is None:
+        event_search_space = _generate_search_space(result_d1, result_d2, coverage, num_thresholds, total_iterations)
+        logger.debug(f"search space is set to {' × '.join(str(event) for event in event_search_space)}")
+    else:
+        # if `event` is given, it should have the corresponding events for each return value
+        if len(event) != len(result_d1):
+            raise ValueError('Given event should have the same dimension as return value.')
+        # here if the event is given, we carefully construct the search space in the following format:
+        # [first_event] × [second_event] × [third_event] × ... × [last_event]
+        # so that when the search begins, only one possible combination can happen which is the given event
+        event_search_space = ((separate_event,) for separate_event in event)
+    # remove the duplicate events (e.g., from a degenerate search range) so that they are not counted twice
+    return tuple(dict.fromkeys(itertools.product(*event_search_space)))
+
+
+def _run_pieces(algorithm, d1, d2, kwargs, total_iterations, prng, memory_budget, first_piece=0):
+    """ Run the algorithm on d1 and d2 for :total_iterations: times, in pieces whose outputs fit in the memory budget.
+    The first piece has at least :first_piece: iterations (or all of them) regardless of the memory budget, so that a
+    search space generated from it does not depend on the budget.
+    :return: generator of (result_d1, result_d2) for each piece, each return value is stored as a row. The rows are
+    views of buffers reused by the next piece.
+    """
+    batched = is_batched(algorithm)
+    # numba-compiled algorithms are run in a compiled loop, the databases are passed as arrays since numba does not
+    # support python lists well
+    compiled = not batched and is_jitted(algorithm)
+    if compiled:
+        d1, d2 = np.asarray(d1), np.asarray(d2)
+    elif not batched and getattr(algorithm, 'buffered_draws', False):
+        # the algorithm runs once per iteration in python and opted in to serve its scalar draws from buffers
+        prng = BufferedGenerator(prng)
+    # get return type by a sample run, batched algorithms carry the type information in their output arrays
+    sample_result = None if batched else algorithm(prng, d1, **kwargs)
+    compiled = compiled and (np.isscalar(sample_result) or isinstance(sample_result, tuple))
+
+    # since we need to store the output in intermediate variables (`result_d1` and `result_d2`), if the total
+    # iterations are very large, peak memory usage would kill the program, therefore we divide the iterations into
+    # pieces whose outputs fit in the memory budget, and reuse the same output buffers for all pieces
+    memory_budget = memory_budget if memory_budget is not None else MEMORY_BUDGET
+    if batched:
+        # the output types of batched algorithms are only known after the first piece, which assumes one float output
+        dtypes = None
+        piece_iterations = _piece_iterations((np.float64, ), memory_budget)
+    else:
+        sample_values = sample_result if isinstance(sample_result, (tuple, list)) else (sample_result, )
+        if not all(isinstance(value, (bool, np.bool_)) or np.issubdtype(type(value), np.number)
+                   for value in sample_values):
+            raise ValueError(f'Unsupported return type: {type(sample_result)}')
+        # the type of one sample does not tell the type of all outputs (e.g., iSVT4 returns either False or a float as
+        # its last value), so the outputs are stored as float64 (or complex128), which holds booleans / integers too
+        dtypes = tuple(np.result_type(type(value), np.float64) for value in sample_values)
+        piece_iterations = _piece_iterations(dtypes, memory_budget)
+        buffers_d1, buffers_d2 = ([np.empty(min(max(piece_iterations, first_piece), total_iterations), dtype=dtype)
+                                   for dtype in dtypes] for _ in range(2))
+    if total_iterations > piece_iterations:
+        logger.debug(f'Iterations too large, divide into pieces of {piece_iterations} iterations')
+
+    remaining_iterations = total_iterations
+    while remaining_iterations > 0:
+        iterations = min(remaining_iterations,
+                         max(piece_iterations, first_piece) if remaining_iterations == total_iterations else
+                         piece_iterations)
+        remaining_iterations -= iterations
+        if batched:
+            result_d1 = _run_batched(algorithm, prng, d1, kwargs, iterations)
+            result_d2 = _run_batched(algorithm, prng, d2, kwargs, iterations)
+            if dtypes is None:
+                dtypes = tuple(row.dtype for row in result_d1)
+                piece_iterations = _piece_iterations(dtypes, memory_budget)
+        else:
+            # the outputs of this piece are written into the beginning of the buffers
+            result_d1, result_d2 = ([buffer[:iterations] for buffer in buffers] for buffers in (buffers_d1, buffers_d2))
+            if compiled:
+                _run_compiled(algorithm, prng, d1, kwargs, result_d1)
+                _run_compiled(algorithm, prng, d2, kwargs, result_d2)
+            elif not isinstance(sample_result, (tuple, list)):
+                # the outputs are written in place, so that no temporary array of the piece is allocated
+                for result, database in ((result_d1[0], d1), (result_d2[0], d2)):
+                    for iteration_number in range(iterations):
+                        result[iteration_number] = algorithm(prng, database, **kwargs)
+            else:
+                for iteration_number in range(iterations):
+                    out_1 = algorithm(prng, d1, **kwargs)
+                    out_2 = algorithm(prng, d2, **kwargs)
+                    for row, (value_1, value_2) in enumerate(zip(out_1, out_2)):
+                        result_d1[row][iteration_number] = value_1
+                        result_d2[row][iteration_number] = value_2
+        yield result_d1, result_d2
+
+
+def count_events(algorithm, d1, d2, kwargs, event, total_iterations, coverage=0.7, num_thresholds=10, seed=None,
+                 events=None, memory_budget=None):
     """ Run the algorithm for :iteration: times, count and return the number of iterations in :event:,
-    event search space is auto-generated if not specified.
-    :param algorithm: The algorithm to run.
+    event search space is auto-generated if not specified. Unlike `run_algorithm`, the counts are not re-ordered, so
+    the counts of different runs can be added up.
+    :param algorithm: The algorithm to run, algorithms supporting the batched protocol (see `is_batched`) are run in
+    whole blocks instead of one call per iteration.
     :param d1: The D1 input to run.
     :param d2: The D2 input to run.
     :param kwargs: The keyword arguments for the algorithm.
-    :param event: The event to test, auto generate event search space if None.
+    :param event: The event to test, auto generate event search space (from the outputs of the first
+    SEARCH_SPACE_ITERATIONS iterations, the categorical outputs are told apart by the number of distinct values
+    relative to :total_iterations:) if None.
     :param total_iterations: The iterations to run.
-    :return: [(cx, cy), ...], [(d1, d2, kwargs, event), ...]
+    :param coverage: The fraction of outputs the auto-generated search space should cover for continuous outputs.
+    :param num_thresholds: The number of events in the auto-generated search space for continuous outputs.
+    :param seed: The seed for the random generator passed to the algorithm, see `spawn_seeds`.
+    :param events: The events to count instead of :event: or the auto-generated search space, e.g., the events of a
+    previous run on the same input.
+    :param memory_budget: The memory (in bytes) for the outputs of d1 and d2, the iterations are run in pieces whose
+    outputs fit in the budget, with the output buffers reused across the pieces. MEMORY_BUDGET is used if None. The
+    piece generating the search space always has SEARCH_SPACE_ITERATIONS iterations, so that the budget does not change
+    the search space.
+    :return: {event: (cx, cy)} The counts of d1 / d2 for each event.
     """
     if not callable(algorithm):
         raise ValueError('Algorithm must be callable')
-    prng = np.random.default_rng()
+    prng = np.random.default_rng(seed)
     # support multiple return values, each return value is stored as a row in result_d1 / result_d2
     # e.g if an algorithm returns (1, 1), result_d1 / result_d2 would be like
     # [
@@ -48,96 +653,45 @@ def run_algorithm(algorithm, d1, d2, kwargs, event, total_iterations):
     #   [x, x, x, ..., x]
     # ]
 
-    # get return type by a sample run
-    all_possible_events = None
+    all_possible_events = tuple(events) if events is not None else None
     event_dict = {}
-    sample_result = algorithm(prng, d1, **kwargs)
-
-    # since we need to store the output in intermediate variables (`result_d1` and `result_d2`), if the total
-    # iterations are very large, peak memory usage would kill the program, therefore we divide the
-    if total_iterations > int(1e6):
-        logger.debug('Iterations too large, divide into different pieces')
-        iteration_tuple = [int(1e6) for _ in range(math.floor(total_iterations / 1e6))] + [total_iterations % int(1e6)]
-    else:
-        iteration_tuple = (total_iterations,)
-    for iterations in iteration_tuple:
-        if np.issubdtype(type(sample_result), np.number):
-            result_d1 = (np.fromiter((algorithm(prng, d1, **kwargs) for _ in range(iterations)),
-                                     dtype=type(sample_result), count=iterations),)
-            result_d2 = (np.fromiter((algorithm(prng, d2, **kwargs) for _ in range(iterations)),
-                                     dtype=type(sample_result), count=iterations),)
-        elif isinstance(sample_result, (tuple, list)):
-            # create a list of numpy array, each containing the output from running
-            result_d1, result_d2 = [np.empty(iterations, dtype=type(sample_result[result_index])) for result_index in
-                                    range(len(sample_result))], \
-                                   [np.empty(iterations, dtype=type(sample_result[result_index])) for result_index in
-                                    range(len(sample_result))],
-
-            for iteration_number in range(iterations):
-                out_1 = algorithm(prng, d1, **kwargs)
-                out_2 = algorithm(prng, d2, **kwargs)
-                for row, (value_1, value_2) in enumerate(zip(out_1, out_2)):
-                    result_d1[row][iteration_number] = value_1
-                    result_d2[row][iteration_number] = value_2
-        else:
-            raise ValueError(f'Unsupported return type: {type(sample_result)}')
-
+    first_piece = SEARCH_SPACE_ITERATIONS if all_possible_events is None and event is None else 0
+    for result_d1, result_d2 in _run_pieces(algorithm, d1, d2, kwargs, total_iterations, prng, memory_budget,
+                                            first_piece):
         # if possible events are not determined yet
         if not all_possible_events:
-            # get desired search space for each return value
-            event_search_space = []
-            if event is None:
-                for row in range(len(result_d1)):
-                    # determine the event search space based on the return type
-                    combined_result = np.concatenate((result_d1[row], result_d2[row]))
-                    unique = np.unique(combined_result)
-
-                    # categorical output
-                    if len(unique) < iterations * 0.002:
-                        event_search_space.append(tuple(int(key) for key in unique))
-                    else:
-                        combined_result.sort()
-                        # find the densest 70% range
-                        search_range = int(0.7 * len(combined_result))
-                        search_max = min(range(search_range, len(combined_result)),
-                                         key=lambda x: combined_result[x] - combined_result[x - search_range])
-                        search_min = search_max - search_range
-
-                        event_search_space.append(
-                            tuple((-float('inf'), float(alpha)) for alpha in
-                                  np.linspace(combined_result[search_min], combined_result[search_max], num=10)))
-
-                logger.debug(f"search space is set to {' × '.join(str(event) for event in event_search_space)}")
-            else:
-                # if `event` is given, it should have the corresponding events for each return value
-                if len(event) != len(result_d1):
-                    raise ValueError('Given event should have the same dimension as return value.')
-                # here if the event is given, we carefully construct the search space in the following format:
-                # [first_event] × [second_event] × [third_event] × ... × [last_event]
-                # so that when the search begins, only one possible combination can happen which is the given event
-                event_search_space = ((separate_event,) for separate_event in event)
-            all_possible_events = tuple(itertools.product(*event_search_space))
-
-        for event in all_possible_events:
-            cx_check, cy_check = np.full(iterations, True, dtype=np.bool), np.full(iterations, True, dtype=np.bool)
-            # check for all events in the return values
-            for row in range(len(result_d1)):
-                if np.issubdtype(type(event[row]), np.number):
-                    cx_check = np.logical_and(cx_check, result_d1[row] == event[row])
-                    cy_check = np.logical_and(cy_check, result_d2[row] == event[row])
-                else:
-                    cx_check = np.logical_and(cx_check, np.logical_and(result_d1[row] > event[row][0],
-                                                                       result_d1[row] < event[row][1]))
-                    cy_check = np.logical_and(cy_check, np.logical_and(result_d2[row] > event[row][0],
-                                                                       result_d2[row] < event[row][1]))
-
-            cx, cy = np.count_nonzero(cx_check), np.count_nonzero(cy_check)
+            all_possible_events = _possible_events(result_d1, result_d2, event, coverage, num_thresholds,
+                                                   total_iterations)
+
+        for event, (cx, cy) in zip(all_possible_events, _count_outputs(result_d1, result_d2, all_possible_events)):
             if event not in event_dict:
                 event_dict[event] = (cx, cy)
             else:
                 old_cx, old_cy = event_dict[event]
                 event_dict[event] = cx + old_cx, cy + old_cy
 
+    return event_dict
+
+
+def run_algorithm(algorithm, d1, d2, kwargs, event, total_iterations, coverage=0.7, num_thresholds=10, seed=None,
+                  memory_budget=None):
+    """ Run the algorithm for :iteration: times, count and return the number of iterations in :event:,
+    event search space is auto-generated if not specified.
+    :param algorithm: The algorithm to run, algorithms supporting the batched protocol (see `is_batched`) are run in
+    whole blocks instead of one call per iteration.
+    :param d1: The D1 input to run.
+    :param d2: The D2 input to run.
+    :param kwargs: The keyword arguments for the algorithm.
+    :param event: The event to test, auto generate event search space if None.
+    :param total_iterations: The iterations to run.
+    :param coverage: The fraction of outputs the auto-generated search space should cover for continuous outputs.
+    :param num_thresholds: The number of events in the auto-generated search space for continuous outputs.
+    :param seed: The seed for the random generator passed to the algorithm, see `spawn_seeds`.
+    :param memory_budget: The memory (in bytes) for the outputs of d1 and d2, see `count_events`.
+    :return: [(cx, cy), ...], [(d1, d2, kwargs, event), ...] with cx >= cy.
+    """
+    event_dict = count_events(algorithm, d1, d2, kwargs, event, total_iterations, coverage=coverage,
+                              num_thresholds=num_thresholds, seed=seed, memory_budget=memory_budget)
     counts, input_event_pairs = [], []
     for event, (cx, cy) in event_dict.items():
         counts.append((cx, cy) if cx > cy else (cy, cx))
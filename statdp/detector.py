@@ -0,0 +1,244 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import logging
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import tqdm
+
+from statdp.core import run_plans, spawn_seeds
+from statdp.generators import generate_arguments, generate_databases, ALL_DIFFER
+from statdp.hypotest import test_statistics, test_statistics_array, _hypothesis_test_plan, _sequential_test_plan
+from statdp.selectors import sample_events, _select_event_plan, _select_event_halving_plan
+
+logger = logging.getLogger(__name__)
+
+
+def _initialize_worker():
+    # compile the numba functions once when the worker starts, instead of in the first task using them
+    test_statistics(1, 0, 1.0, 2, False)
+    test_statistics_array(np.ones(1, dtype=np.int64), np.zeros(1, dtype=np.int64), 1.0, 2)
+
+
+def _prepare_detection(algorithm, test_epsilon, default_kwargs, databases, num_input, sensitivity, seed):
+    """ Generate the inputs and derive the seeds of a detection.
+    :return: (input_list, test_epsilon tuple, seed of the shared samples, [(select_seed, test_seed), ...] per epsilon)
+    """
+    input_list = []
+    if databases is not None:
+        d1, d2 = databases
+        kwargs = generate_arguments(algorithm, d1, d2, default_kwargs=default_kwargs)
+        input_list = ((d1, d2, kwargs),)
+    else:
+        num_input = (int(num_input), ) if isinstance(num_input, (int, float)) else num_input
+        for num in num_input:
+            input_list.extend(
+                generate_databases(algorithm, num, default_kwargs=default_kwargs, sensitivity=sensitivity))
+
+    # convert int/float or iterable into tuple (so that it has length information)
+    test_epsilon = (test_epsilon, ) if isinstance(test_epsilon, (int, float)) else tuple(test_epsilon)
+
+    # derive independent seeds for the shared samples and for the event selection / hypothesis test of each epsilon
+    sample_seed, *epsilon_seeds = spawn_seeds(seed, len(test_epsilon) + 1)
+    return input_list, test_epsilon, sample_seed, [epsilon_seed.spawn(2) for epsilon_seed in epsilon_seeds]
+
+
+def _detect_epsilon_plan(algorithm, input_list, epsilon, seeds, event_iterations, detect_iterations, samples, alpha,
+                         adaptive_selection):
+    # the event selection and hypothesis test of a test epsilon as a plan (see `statdp.core.run_plan`), it returns the
+    # same result as `Detector.detect` for the epsilon
+    select_seed, test_seed = seeds
+    if adaptive_selection:
+        d1, d2, kwargs, event = yield from _select_event_halving_plan(
+            algorithm, input_list, epsilon, event_iterations, coverage=0.7, num_thresholds=10, seed=select_seed, eta=2)
+    else:
+        d1, d2, kwargs, event = yield from _select_event_plan(
+            algorithm, input_list, epsilon, event_iterations, samples, coverage=0.7, num_thresholds=10,
+            seed=select_seed)
+    if alpha is None:
+        p = yield from _hypothesis_test_plan(algorithm, d1, d2, kwargs, event, epsilon, detect_iterations,
+                                             report_p2=False, method='auto', seed=test_seed)
+        return epsilon, float(p), d1, d2, kwargs, event
+    p, used_iterations = yield from _sequential_test_plan(algorithm, d1, d2, kwargs, event, epsilon, detect_iterations,
+                                                          alpha=alpha, method='auto', seed=test_seed)
+    return epsilon, float(p), d1, d2, kwargs, event, used_iterations
+
+
+class Detector:
+    """ A detection session which owns a long-lived pool of workers, the workers are started (and the numba functions
+    compiled) once, and are reused by all detections submitted to the session. The session should be closed after use,
+    e.g., by using it as a context manager:
+
+    with Detector() as detector:
+        for epsilon in (0.2, 0.7, 1.5):
+            result = detector.detect(algorithm, test_epsilon, {'epsilon': epsilon})
+    """
+
+    def __init__(self, cores=None, executor='process', workers=None):
+        """
+        :param cores: The number of max workers for the process / thread pool, os.cpu_count() is used if None.
+        :param executor: The workers to run the algorithm with, 'process' for a multiprocessing.Pool(), 'thread' for a
+        concurrent.futures.ThreadPoolExecutor (for algorithms releasing the GIL, e.g., vectorized or nogil numba
+        algorithms), 'serial' to run in the current process, or an existing multiprocessing.Pool() or
+        concurrent.futures.Executor (e.g., a ProcessPoolExecutor with the forkserver start method), which is not shut
+        down by the session.
+        :param workers: The number of workers of an existing :executor:, used for the worker utilization. The connected
+        workers are used for a `statdp.distributed.DistributedExecutor` if None, otherwise the utilization is unknown.
+        """
+        if workers is not None and isinstance(executor, str):
+            raise ValueError('workers is only given for an existing executor, the session sizes its own pool by cores')
+        self.cores = cores
+        # the fraction of time the workers were busy during the last detection
+        self.utilization = None
+        self._owned = isinstance(executor, str)
+        self._workers = workers if not isinstance(executor, str) else 1 if executor == 'serial' else \
+            cores if cores else os.cpu_count()
+        if executor == 'process':
+            self._executor = mp.Pool(cores, initializer=_initialize_worker)
+        elif executor == 'thread':
+            self._executor = concurrent.futures.ThreadPoolExecutor(cores)
+        elif executor == 'serial':
+            self._executor = None
+        elif isinstance(executor, str):
+            raise ValueError(f"executor must be 'process', 'thread', 'serial' or an executor, got {executor}")
+        else:
+            self._executor = executor
+
+    @property
+    def workers(self):
+        """ The number of workers of the executor, None if it is unknown. """
+        if self._workers is None:
+            # the workers currently connected to a DistributedExecutor
+            return getattr(self._executor, 'worker_count', None) or None
+        return self._workers
+
+    @property
+    def executor(self):
+        """ The executor of the session, it can be passed to `select_event` and `hypothesis_test`. """
+        return self._executor
+
+    def detect(self, algorithm, test_epsilon, default_kwargs=None, databases=None, num_input=(5, 10),
+               event_iterations=100000, detect_iterations=500000, sensitivity=ALL_DIFFER, quiet=False,
+               reuse_samples=False, seed=None, alpha=None, adaptive_selection=False, concurrent_epsilons=2):
+        """ Run a detection with the workers of the session, see `detect_counterexample` for the parameters.
+        :param concurrent_epsilons: The number of test epsilons to process at the same time, see `detect_iter`.
+        :return: [(epsilon, p, d1, d2, kwargs, event)] The epsilon-p pairs along with databases/arguments/selected
+        event, with the iterations used by the hypothesis test appended if :alpha: is given.
+        """
+        results = sorted(self._detect(algorithm, test_epsilon, default_kwargs, databases, num_input, event_iterations,
+                                      detect_iterations, sensitivity, quiet, reuse_samples, seed, alpha,
+                                      adaptive_selection, concurrent_epsilons), key=lambda result: result[0])
+        return [result for _, result in results]
+
+    def detect_iter(self, algorithm, test_epsilon, default_kwargs=None, databases=None, num_input=(5, 10),
+                    event_iterations=100000, detect_iterations=500000, sensitivity=ALL_DIFFER, quiet=False,
+                    reuse_samples=False, seed=None, alpha=None, adaptive_selection=False, concurrent_epsilons=2):
+        """ Run a detection like `detect` but yield the result of each test epsilon as soon as it is ready. With
+        :concurrent_epsilons: > 1, the event selection / hypothesis test of several test epsilons run at the same time
+        on the workers of the session (e.g., the event selection for the next epsilon overlaps the hypothesis test of
+        the current one, see `statdp.core.run_plans`), and the results arrive in the order of completion. The results
+        do not depend on :concurrent_epsilons:. Closing the generator early cancels the tasks not started yet. The
+        worker utilization of the detection is logged and kept in `utilization` (None if the number of workers of the
+        executor is unknown).
+        :return: generator of (epsilon, p, d1, d2, kwargs, event) results, see `detect`.
+        """
+        for _, result in self._detect(algorithm, test_epsilon, default_kwargs, databases, num_input, event_iterations,
+                                      detect_iterations, sensitivity, quiet, reuse_samples, seed, alpha,
+                                      adaptive_selection, concurrent_epsilons):
+            yield result
+
+    def _detect(self, algorithm, test_epsilon, default_kwargs, databases, num_input, event_iterations,
+                detect_iterations, sensitivity, quiet, reuse_samples, seed, alpha, adaptive_selection,
+                concurrent_epsilons):
+        # yields (index of the test epsilon, result) in the order of completion
+        if reuse_samples and adaptive_selection:
+            raise ValueError('reuse_samples cannot be used with adaptive_selection, which samples for each epsilon')
+        # initialize an empty default kwargs if None is given
+        default_kwargs = default_kwargs if default_kwargs else {}
+
+        logger.info(f'Start detection for counterexample on {algorithm.__name__} with test epsilon {test_epsilon}')
+        logger.info(f'Options -> default_kwargs: {default_kwargs} | databases: {databases} | cores:{self.cores} | '
+                    f'executor: {self._executor} | '
+                    f'reuse_samples: {reuse_samples} | seed: {seed} | alpha: {alpha} | '
+                    f'adaptive_selection: {adaptive_selection} | concurrent_epsilons: {concurrent_epsilons}')
+
+        input_list, test_epsilon, sample_seed, epsilon_seeds = _prepare_detection(
+            algorithm, test_epsilon, default_kwargs, databases, num_input, sensitivity, seed)
+
+        # the samples for event selection are independent of the test epsilon, only the p-values depend on it
+        samples = sample_events(algorithm, input_list, event_iterations, self._executor, quiet=quiet,
+                                seed=sample_seed) if reuse_samples else None
+
+        # the test epsilons run as plans in a pipeline (see `statdp.core.run_plans`): the hypothesis test tasks of an
+        # epsilon are queued while the event selection of the next one runs, and the p-values of a finished event
+        # selection are computed here while the workers run the tasks of the other epsilons
+        plans = (_detect_epsilon_plan(algorithm, input_list, epsilon, seeds, event_iterations, detect_iterations,
+                                      samples, alpha, adaptive_selection)
+                 for epsilon, seeds in zip(test_epsilon, epsilon_seeds))
+        task_times, start = [], time.perf_counter()
+        completed = run_plans(plans, self._executor, window=concurrent_epsilons, task_times=task_times)
+        try:
+            for index, result in tqdm.tqdm(completed, total=len(test_epsilon), unit='test', desc='Detection',
+                                           disable=quiet):
+                epsilon, p, d1, d2, kwargs, event, *_ = result
+                if not quiet:
+                    tqdm.tqdm.write(f'Epsilon: {epsilon} | p-value: {p:5.3f} | Event: {event}')
+                logger.debug(f'D1: {d1} | D2: {d2} | kwargs: {kwargs}')
+                yield index, result
+        finally:
+            completed.close()
+            self._report_utilization(task_times, time.perf_counter() - start)
+
+    def _report_utilization(self, task_times, elapsed):
+        workers = self.workers
+        busy = sum(task_times)
+        if workers is None:
+            self.utilization = None
+            logger.debug(f'the number of workers of {self._executor} is unknown, the utilization is not reported')
+            return
+        self.utilization = min(busy / (elapsed * workers), 1.0) if elapsed > 0 else 0.0
+        logger.info(f'worker utilization: {self.utilization:.0%} | busy: {busy:.2f}s | elapsed: {elapsed:.2f}s | '
+                    f'workers: {workers} | tasks: {len(task_times)}')
+
+    def close(self):
+        """ Wait for the workers to finish and shut down the pool, if it is created by the session. """
+        if not self._owned or self._executor is None:
+            return
+        if isinstance(self._executor, concurrent.futures.Executor):
+            self._executor.shutdown()
+        else:
+            self._executor.close()
+            self._executor.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # like multiprocessing.Pool, the process workers are terminated without waiting for the outstanding tasks
+        if self._owned and hasattr(self._executor, 'terminate'):
+            self._executor.terminate()
+            self._executor.join()
+        else:
+            self.close()
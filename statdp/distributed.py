@@ -0,0 +1,238 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Distributed execution over sockets. The coordinator runs a `DistributedExecutor`, which can be passed as the
+executor to `Detector` / `detect_counterexample` / `select_event` / `hypothesis_test`, and the workers on other nodes
+connect to it with `run_worker` (or `python -m statdp.distributed HOST:PORT --authkey KEY`). The tasks and results are
+pickled over multiprocessing.connection, the tasks of statdp are blocks of iterations which only return their count
+tables. Since each block runs with its own seed, the tasks of a lost (or hung, see `task_timeout`) worker are simply
+re-issued to the other workers.
+"""
+import argparse
+import collections
+import concurrent.futures
+import functools
+import logging
+import multiprocessing as mp
+import os
+import threading
+from multiprocessing.connection import Client, Listener
+from multiprocessing.reduction import ForkingPickler
+
+logger = logging.getLogger(__name__)
+
+# the tasks are pickled one at a time, since pickling numba functions is not thread-safe (the first pickle of a
+# dispatcher assigns its uuid)
+_pickle_lock = threading.Lock()
+
+
+def run_worker(address, authkey):
+    """ Connect to the coordinator at :address: and run the tasks it sends until it shuts down.
+    :param address: The (host, port) of the `DistributedExecutor`.
+    :param authkey: The authentication key (bytes) of the `DistributedExecutor`.
+    """
+    with Client(tuple(address), authkey=authkey) as connection:
+        while True:
+            try:
+                task = connection.recv()
+            except EOFError:
+                return
+            if task is None:
+                return
+            function, args = task
+            try:
+                result = True, function(*args)
+            except Exception as error:
+                result = False, error
+            try:
+                connection.send(result)
+            except OSError:
+                # the coordinator is gone, or it has disconnected this worker as hung (see `task_timeout`)
+                return
+            except Exception as error:
+                # the result cannot be pickled, which happens before anything is sent
+                connection.send((False, RuntimeError(f'cannot send the result: {error}')))
+
+
+class DistributedExecutor(concurrent.futures.Executor):
+    """ A concurrent.futures.Executor which sends the tasks to the workers connected over sockets (see `run_worker`).
+    Workers can join at any time, each worker runs one task at a time, and the task of a lost worker is re-issued to
+    the other workers (at most :max_retries: times). The tasks are only marked as running when they are sent to a
+    worker, so the waiting tasks can still be cancelled.
+    """
+
+    def __init__(self, address=('localhost', 0), authkey=None, max_retries=3, task_timeout=None):
+        """
+        :param address: The (host, port) to listen on for workers, a free port is picked if port is 0.
+        :param authkey: The authentication key (bytes) the workers must present, a random key is generated if None.
+        :param max_retries: The maximum number of times a task is re-issued after losing its worker.
+        :param task_timeout: The seconds to wait for the result of a task, after which the worker is considered hung:
+        it is disconnected and the task is re-issued like the task of a lost worker. Wait forever if None.
+        """
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self.max_retries = max_retries
+        self.task_timeout = task_timeout
+        self._listener = Listener(tuple(address), authkey=self.authkey)
+        self._tasks = collections.deque()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._worker_threads = []
+        self._local_workers = []
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self._accept_thread.start()
+
+    @property
+    def address(self):
+        """ The (host, port) the executor listens on. """
+        return self._listener.address
+
+    @property
+    def worker_count(self):
+        """ The number of workers currently connected. """
+        return sum(thread.is_alive() for thread in self._worker_threads)
+
+    def start_local_workers(self, number):
+        """ Start :number: worker processes on this machine, e.g., to stand in for remote nodes.
+        :return: list of the multiprocessing.Process of the workers.
+        """
+        context = mp.get_context('spawn')
+        processes = [context.Process(target=run_worker, args=(self.address, self.authkey), daemon=True)
+                     for _ in range(number)]
+        for process in processes:
+            process.start()
+        self._local_workers.extend(processes)
+        return processes
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception as error:
+                # the listener is closed on shutdown, a failed authentication does not stop the executor
+                if self._shutdown:
+                    return
+                logger.warning(f'failed to accept a worker: {error}')
+                continue
+            if self._shutdown:
+                connection.close()
+                return
+            logger.debug(f'worker connected from {self._listener.last_accepted}')
+            thread = threading.Thread(target=self._serve, args=(connection, ), daemon=True)
+            self._worker_threads.append(thread)
+            thread.start()
+
+    def _next_task(self):
+        with self._condition:
+            while not self._tasks and not self._shutdown:
+                self._condition.wait()
+            return self._tasks.popleft() if self._tasks else None
+
+    def _serve(self, connection):
+        # send the tasks one at a time to the worker of this connection
+        while True:
+            task = self._next_task()
+            if task is None:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+                connection.close()
+                return
+            future, function, args, attempts = task
+            # a re-issued task is already running, a cancelled task is dropped
+            if attempts == 0 and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with _pickle_lock:
+                    payload = ForkingPickler.dumps((function, args))
+                connection.send_bytes(payload)
+                if self.task_timeout is not None and not connection.poll(self.task_timeout):
+                    raise TimeoutError(f'no result after {self.task_timeout} seconds')
+                succeeded, value = connection.recv()
+            except (EOFError, OSError) as error:
+                # the worker is lost or hung (TimeoutError is an OSError), the task is re-issued ahead of the waiting
+                # tasks and the connection is closed, so that a hung worker exits once it tries to send its result
+                connection.close()
+                if attempts >= self.max_retries:
+                    future.set_exception(RuntimeError(f'task failed after losing {attempts + 1} workers'))
+                else:
+                    logger.warning(f'lost a worker ({error!r}), re-issuing its task')
+                    with self._condition:
+                        self._tasks.appendleft((future, function, args, attempts + 1))
+                        self._condition.notify()
+                return
+            except Exception as error:
+                # e.g., the task cannot be pickled, which happens before anything is sent
+                future.set_exception(error)
+                continue
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def submit(self, fn, *args, **kwargs):
+        if kwargs:
+            fn, args = functools.partial(fn, *args, **kwargs), ()
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new tasks after shutdown')
+            self._tasks.append((future, fn, args, 0))
+            self._condition.notify()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._condition:
+            if cancel_futures:
+                for future, _, _, attempts in self._tasks:
+                    # the re-issued tasks are already running and cannot be cancelled
+                    if attempts > 0:
+                        future.set_exception(concurrent.futures.CancelledError())
+                    else:
+                        future.cancel()
+                self._tasks.clear()
+            self._shutdown = True
+            self._condition.notify_all()
+        # wake up the accept thread with a dummy connection so that it sees the shutdown
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        self._accept_thread.join()
+        self._listener.close()
+        if wait:
+            for thread in self._worker_threads:
+                thread.join()
+            for process in self._local_workers:
+                process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a statdp worker connecting to a DistributedExecutor.')
+    parser.add_argument('address', help='HOST:PORT of the executor')
+    parser.add_argument('--authkey', required=True, help='the authentication key of the executor')
+    arguments = parser.parse_args()
+    host, port = arguments.address.rsplit(':', 1)
+    run_worker((host, int(port)), arguments.authkey.encode())
+
+
+if __name__ == '__main__':
+    main()
@@ -22,35 +22,154 @@
 import functools
 import logging
 import math
-import multiprocessing as mp
 
 import numpy as np
 import numba
 
-from statdp.core import run_algorithm
+from statdp.core import count_events, run_plan, spawn_seeds, split_iterations, BLOCK_SIZE
 import statdp._hypergeom as hypergeom
 
 logger = logging.getLogger(__name__)
 
 
-@numba.njit
-def test_statistics(cx, cy, epsilon, iterations):
-    """ Calculate p-value based on observed results.
+# the binomial tails whose probability mass is below this bound are left out when computing the p-value
+_TAIL_MASS = 1e-12
+
+# the normal approximation of the hypergeometric sf is used automatically from this number of iterations, see
+# `hypothesis_test`
+APPROXIMATION_THRESHOLD = int(1e7)
+
+
+@numba.njit(cache=True)
+def _hypergeom_sf(k, M, n, N, ln_factorial):
+    # look up the log-factorials in the table if one is given (i.e., non-empty)
+    return hypergeom.sf_table(k, M, n, N, ln_factorial) if len(ln_factorial) > 0 else hypergeom.sf(k, M, n, N)
+
+
+@numba.njit(cache=True)
+def _hypergeom_pmf(k, M, n, N, ln_factorial):
+    return hypergeom.pmf_table(k, M, n, N, ln_factorial) if len(ln_factorial) > 0 else hypergeom.pmf(k, M, n, N)
+
+
+@numba.njit(cache=True)
+def _approximate_sf(k, M, n, N, ln_factorial):
+    # the normal approximation has an absolute error below 3e-4 once the standard deviation reaches 5 (n = M / 2),
+    # for fewer draws the exact recursion is short anyway
+    if N * (n / M) * (1 - n / M) * (M - N) / (M - 1) >= 25:
+        return hypergeom.sf_normal(k, M, n, N)
+    return _hypergeom_sf(k, M, n, N, ln_factorial)
+
+
+@numba.njit(cache=True)
+def test_statistics(cx, cy, epsilon, iterations, approximate=False):
+    """ Calculate p-value based on observed results. The p-value is the expectation of
+    hypergeom.sf(k - 1, 2 * iterations, iterations, k + cy) over k ~ Binomial(cx, 1 / exp(epsilon)), which is computed
+    deterministically by summing over the binomial distribution, leaving out tails with probability mass below 1e-12.
     :param cx: The observed count of running algorithm with database 1 that falls into the event
     :param cy:The observed count of running algorithm with database 2 that falls into the event
     :param epsilon: The epsilon to test for.
     :param iterations: The total iterations for running algorithm.
+    :param approximate: Use the normal approximation of hypergeom.sf (see `_hypergeom.sf_normal`) instead of the exact
+    value, the absolute error of the p-value is then below 3e-4.
     :return: p-value
     """
-    # average p value
-    sample_num = 200
-    p_value = 0
-    for new_cx in np.random.binomial(cx, 1.0 / (np.exp(epsilon)), sample_num):
-        p_value += hypergeom.sf(new_cx - 1, 2 * iterations, iterations, new_cx + cy)
-    return p_value / sample_num
+    return _p_value(cx, cy, epsilon, iterations, np.empty(0), approximate)
+
+
+@numba.njit(cache=True)
+def test_statistics_array(cx, cy, epsilon, iterations, approximate=False):
+    """ Calculate p-values for arrays of observed counts with the same epsilon and iterations (e.g., the counts of all
+    events in the search space). The log-factorial table is computed once and shared by all p-values.
+    :param cx: numpy array of the observed counts of running algorithm with database 1 that fall into the events
+    :param cy: numpy array of the observed counts of running algorithm with database 2 that fall into the events
+    :param epsilon: The epsilon to test for.
+    :param iterations: The total iterations for running algorithm.
+    :param approximate: Use the normal approximation of hypergeom.sf, see `test_statistics`.
+    :return: numpy array of p-values
+    """
+    ln_factorial = hypergeom.ln_factorial_table(2 * iterations)
+    p_values = np.empty(len(cx))
+    for i in range(len(cx)):
+        p_values[i] = _p_value(cx[i], cy[i], epsilon, iterations, ln_factorial, approximate)
+    return p_values
+
+
+@numba.njit(cache=True)
+def _p_value(cx, cy, epsilon, iterations, ln_factorial, approximate):
+    probability = np.exp(-epsilon)
+    M, n = 2 * iterations, iterations
+    if cx == 0 or probability == 0:
+        # k is always 0, and sf(-1) = 1
+        return 1.0
+    elif probability >= 1:
+        # k is always cx
+        if approximate:
+            return _approximate_sf(cx - 1, M, n, cx + cy, ln_factorial)
+        return _hypergeom_sf(cx - 1, M, n, cx + cy, ln_factorial)
+
+    # the binomial pmf is computed from its mode with the recursive definition
+    # P(k + 1) = P(k) * ((cx - k) / (k + 1)) * (p / (1 - p))
+    odds = probability / (1 - probability)
+    mode = min(int((cx + 1) * probability), cx)
+    mode_pmf = np.exp(math.lgamma(cx + 1) - math.lgamma(mode + 1) - math.lgamma(cx - mode + 1) +
+                      mode * np.log(probability) + (cx - mode) * np.log1p(-probability))
+
+    # find the lowest k to start with, the pmf ratio P(k - 1) / P(k) decreases as k decreases, so the remaining lower
+    # tail is bounded by P(k) * ratio / (1 - ratio) once the ratio drops below 1
+    low, low_pmf = mode, mode_pmf
+    while low > 0:
+        ratio = low / ((cx - low + 1) * odds)
+        if ratio < 1 and low_pmf * ratio / (1 - ratio) < _TAIL_MASS:
+            break
+        low_pmf *= ratio
+        low -= 1
+
+    # sf(k - 1, M, n, k + cy) = P(X >= k) where X follows the hypergeometric distribution with k + cy draws. Instead of
+    # re-computing sf for each k, we use the relationship between the distributions with N and N + 1 draws
+    # P(X_(N+1) >= k + 1) = P(X_N >= k) - P(X_N = k) * (M - N - n + k) / (M - N)
+    # P(X_(N+1) = k + 1) = P(X_N = k) * ((n - k) / (k + 1)) * ((N + 1) / (M - N))
+    # with the normal approximation, sf is simply evaluated for each k in constant time
+    k, binomial_pmf = low, low_pmf
+    if approximate:
+        survival, hypergeom_pmf = _approximate_sf(k - 1, M, n, k + cy, ln_factorial), 0.0
+    else:
+        survival = _hypergeom_sf(k - 1, M, n, k + cy, ln_factorial)
+        hypergeom_pmf = _hypergeom_pmf(k, M, n, k + cy, ln_factorial)
+    p_value, total_mass = 0.0, 0.0
+    while True:
+        p_value += binomial_pmf * survival
+        total_mass += binomial_pmf
+        if k == cx:
+            break
+        # the upper tail is bounded in the same way as the lower tail
+        ratio = (cx - k) * odds / (k + 1)
+        if k >= mode and ratio < 1 and binomial_pmf * ratio / (1 - ratio) < _TAIL_MASS:
+            break
+        binomial_pmf *= ratio
+        if approximate:
+            k += 1
+            survival = _approximate_sf(k - 1, M, n, k + cy, ln_factorial)
+            continue
+        draws = k + cy
+        survival -= hypergeom_pmf * (M - draws - n + k) / (M - draws)
+        hypergeom_pmf *= ((n - k) / (k + 1)) * ((draws + 1) / (M - draws))
+        k += 1
+        if hypergeom_pmf < 1e-250:
+            # the recursion cannot recover from an underflow, use the direct definition for tiny pmf
+            hypergeom_pmf = _hypergeom_pmf(k, M, n, k + cy, ln_factorial)
+
+    # normalize by the mass we have summed over, and clip the accumulated rounding errors
+    return min(max(p_value / total_mass, 0.0), 1.0)
+
 
+def _run_block(block, algorithm, d1, d2, kwargs, event):
+    iterations, seed = block
+    (cx, cy), = count_events(algorithm, d1, d2, kwargs, event, iterations, seed=seed).values()
+    return cx, cy
 
-def hypothesis_test(algorithm, d1, d2, kwargs, event, epsilon, iterations, process_pool, report_p2=True):
+
+def hypothesis_test(algorithm, d1, d2, kwargs, event, epsilon, iterations, process_pool, report_p2=True,
+                    method='auto', seed=None, return_method=False):
     """ Run hypothesis tests on given input and events.
     :param algorithm: The algorithm to run on.
     :param kwargs: The keyword arguments the algorithm needs.
@@ -59,32 +178,122 @@ def hypothesis_test(algorithm, d1, d2, kwargs, event, epsilon, iterations, proce
     :param event: The event set.
     :param iterations: Number of iterations to run.
     :param epsilon: The epsilon value to test for.
-    :param process_pool: The multiprocessing.Pool() to use.
+    :param process_pool: The multiprocessing.Pool() to use, or any concurrent.futures.Executor, or None to run in the
+    current process.
     :param report_p2: The boolean to whether report p2 or not.
-    :return: p values.
+    :param method: The method to calculate p-values, 'exact', 'approximate' (see `test_statistics`) or 'auto', which
+    uses the approximation when iterations >= APPROXIMATION_THRESHOLD. The method used is reported in the logs, and
+    returned with :return_method:.
+    :param seed: The seed for running the algorithm (None, an int or a np.random.SeedSequence), the p-values are
+    identical for the same seed regardless of the number of processes in the pool.
+    :param return_method: Append the method used ('exact' or 'approximate') to the returned p-values.
+    :return: p values, e.g., (p1, p2, 'exact') with :return_method:.
     """
-    # use undocumented mp.Pool._processes to get the number of max processes for the pool, this is unstable and
-    # may break in the future, therefore we fall back to mp.cpu_count() if it is not accessible
-    core_count = process_pool._processes if process_pool._processes and isinstance(process_pool._processes, int) \
-        else mp.cpu_count()
-    if iterations < core_count:
-        process_iterations = [iterations]
-    else:
-        process_iterations = [int(math.floor(float(iterations) / core_count)) for _ in range(core_count)]
-        # add the remaining iterations to the last index
-        process_iterations[core_count - 1] += iterations % process_iterations[core_count - 1]
-
-    # start the pool to run the algorithm and collects the statistics
-    cx, cy = 0, 0
-    # fill in other arguments for running the algorithm, leaving `iterations` to be filled
-    runner = functools.partial(run_algorithm, algorithm, d1, d2, kwargs, event)
-    for ((local_cx, local_cy), *_), _ in process_pool.imap_unordered(runner, process_iterations):
-        cx += local_cx
-        cy += local_cy
+    return run_plan(_hypothesis_test_plan(algorithm, d1, d2, kwargs, event, epsilon, iterations, report_p2, method,
+                                          seed, return_method), process_pool)
+
+
+def _hypothesis_test_plan(algorithm, d1, d2, kwargs, event, epsilon, iterations, report_p2, method, seed,
+                          return_method=False):
+    # the plan of `hypothesis_test`, see `run_plan`
+    if method not in ('auto', 'exact', 'approximate'):
+        raise ValueError(f"method must be 'auto', 'exact' or 'approximate', got {method}")
+    if method == 'auto':
+        method = 'approximate' if iterations >= APPROXIMATION_THRESHOLD else 'exact'
+    # split the iterations into blocks of fixed size, each block runs with its own child seed so that the counts do not
+    # depend on the number of processes
+    process_iterations = split_iterations(iterations)
+    blocks = list(zip(process_iterations, spawn_seeds(seed, len(process_iterations))))
+
+    # fill in other arguments for running the algorithm, leaving the block to be filled
+    runner = functools.partial(_run_block, algorithm=algorithm, d1=d1, d2=d2, kwargs=kwargs, event=event)
+    # run the blocks on the workers and collect the statistics
+    block_counts = yield runner, blocks
+    cx = sum(local_cx for local_cx, _ in block_counts)
+    cy = sum(local_cy for _, local_cy in block_counts)
     cx, cy = (cx, cy) if cx > cy else (cy, cx)
 
     # calculate and return p value
+    approximate = method == 'approximate'
+    logger.info(f'p-value is calculated with the {method} method | cx: {cx} | cy: {cy} | iterations: {iterations}')
     if report_p2:
-        return test_statistics(cx, cy, epsilon, iterations), test_statistics(cy, cx, epsilon, iterations)
+        # both p-values in one pass sharing the log-factorial table
+        p_values = tuple(float(p) for p in test_statistics_array(np.array([cx, cy], dtype=np.int64),
+                                                                 np.array([cy, cx], dtype=np.int64),
+                                                                 epsilon, iterations, approximate))
     else:
-        return test_statistics(cx, cy, epsilon, iterations)
+        p_values = test_statistics(cx, cy, epsilon, iterations, approximate),
+    if return_method:
+        return (*p_values, method)
+    return p_values if report_p2 else p_values[0]
+
+
+def _spent_alpha(alpha, fraction):
+    # the alpha spending function alpha * t^3 spends little of the significance level on the early looks, so that the
+    # final look is close to the fixed sample test
+    return alpha * fraction ** 3
+
+
+def sequential_test(algorithm, d1, d2, kwargs, event, epsilon, iterations, process_pool, alpha=0.05, method='auto',
+                    seed=None):
+    """ Run the hypothesis test sequentially, the p-value is checked after 1, 2, 4, 8, ... times BLOCK_SIZE iterations
+    (and after :iterations:) and the test stops early once the decision at significance level :alpha: is settled.
+    Each look k is given a part alpha_k of the significance level (alpha spending with alpha * (n_k / iterations)^3),
+    the test rejects at look k if its p-value is at most alpha_k, and stops without rejecting once the p-value is at
+    least 1 - alpha. The reported p-value is adjusted for the multiple looks (p * alpha / alpha_k, capped at 1), so
+    that it can be compared to :alpha: as usual. With the same seed, the counts of a test running to the end are the
+    same as those of `hypothesis_test`.
+    :param algorithm: The algorithm to run on.
+    :param kwargs: The keyword arguments the algorithm needs.
+    :param d1: Database 1.
+    :param d2: Database 2.
+    :param event: The event set.
+    :param iterations: Maximum number of iterations to run.
+    :param epsilon: The epsilon value to test for.
+    :param process_pool: The multiprocessing.Pool() to use, or any concurrent.futures.Executor, or None to run in the
+    current process.
+    :param alpha: The significance level of the test.
+    :param method: The method to calculate p-values, see `hypothesis_test`, 'auto' decides for each look.
+    :param seed: The seed for running the algorithm, see `hypothesis_test`.
+    :return: (p-value, the iterations actually used)
+    """
+    return run_plan(_sequential_test_plan(algorithm, d1, d2, kwargs, event, epsilon, iterations, alpha, method, seed),
+                    process_pool)
+
+
+def _sequential_test_plan(algorithm, d1, d2, kwargs, event, epsilon, iterations, alpha, method, seed):
+    # the plan of `sequential_test`, see `run_plan`
+    if method not in ('auto', 'exact', 'approximate'):
+        raise ValueError(f"method must be 'auto', 'exact' or 'approximate', got {method}")
+    if not 0 < alpha < 1:
+        raise ValueError(f'alpha must be in (0, 1), got {alpha}')
+    # the blocks and seeds are the same as in `hypothesis_test`, the looks are at multiples of the block size
+    process_iterations = split_iterations(iterations)
+    blocks = list(zip(process_iterations, spawn_seeds(seed, len(process_iterations))))
+    looks, look = [], BLOCK_SIZE
+    while look < iterations:
+        looks.append(look)
+        look *= 2
+    looks.append(iterations)
+
+    runner = functools.partial(_run_block, algorithm=algorithm, d1=d1, d2=d2, kwargs=kwargs, event=event)
+    cx, cy, used_iterations, p_value = 0, 0, 0, 1.0
+    for look in looks:
+        # run the blocks up to this look
+        first_block, last_block = used_iterations // BLOCK_SIZE, math.ceil(look / BLOCK_SIZE)
+        for local_cx, local_cy in (yield runner, blocks[first_block:last_block]):
+            cx += local_cx
+            cy += local_cy
+        look_alpha = _spent_alpha(alpha, look / iterations) - _spent_alpha(alpha, used_iterations / iterations)
+        used_iterations = look
+
+        approximate = method == 'approximate' or (method == 'auto' and look >= APPROXIMATION_THRESHOLD)
+        p_value = test_statistics(max(cx, cy), min(cx, cy), epsilon, look, approximate)
+        logger.debug(f'sequential look | iterations: {look} | cx: {cx} | cy: {cy} | p-value: {p_value} | '
+                     f'alpha: {look_alpha}')
+        if p_value <= look_alpha or p_value >= 1 - alpha:
+            break
+
+    logger.info(f'sequential test stopped after {used_iterations} / {iterations} iterations | cx: {max(cx, cy)} | '
+                f'cy: {min(cx, cy)}')
+    return min(p_value * alpha / look_alpha, 1.0), used_iterations
@@ -20,58 +20,290 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import functools
+import itertools
 import logging
+import math
 
 import numpy as np
 import tqdm
 
-from statdp.hypotest import test_statistics
-from statdp.core import run_algorithm
+from statdp.hypotest import test_statistics_array
+from statdp.summary import summarize_outputs
+from statdp.core import run_plan, spawn_seeds, split_iterations, BLOCK_SIZE
 
 logger = logging.getLogger(__name__)
 
 
-def _evaluate_input(input_triplet, algorithm, iterations):
-    d1, d2, kwargs = input_triplet
-    return run_algorithm(algorithm, d1, d2, kwargs, None, iterations)
+def _sample_block(task, algorithm, coverage, num_thresholds, search_iterations):
+    # the workers only send back the compact summary of the outputs of the block, see `statdp.summary`, the search
+    # space generated by the first block of an input is decided for the :search_iterations: of all its blocks
+    index, (d1, d2, kwargs), iterations, seed, layout = task
+    return index, summarize_outputs(algorithm, d1, d2, kwargs, iterations, layout=layout, coverage=coverage,
+                                    num_thresholds=num_thresholds, seed=seed, search_iterations=search_iterations)
 
 
-def select_event(algorithm, input_list, epsilon, iterations, process_pool, quiet=False):
+def _merge_blocks(results, input_summaries):
+    """ Merge the (index, Summary) results of the block tasks into the summaries of their inputs in
+    :input_summaries:. """
+    for index, summary in results:
+        merged = input_summaries[index]
+        input_summaries[index] = summary if merged is None else merged.merge(summary)
+
+
+def _summary_counts(summary, iterations):
+    """ Count the events of the search space on the summary of :iterations: outputs of an input, leaving out the events
+    that cannot be selected: an event whose component holds too few outputs for the smallest threshold of `_p_values`
+    (which is at epsilon = 0) gets an infinite p-value for any epsilon, so these events are pruned by their marginal
+    counts before the events are counted jointly. All events are kept if none of them is left.
+    :return: {event: (cx, cy)} The counts of d1 / d2 for each remaining event.
+    """
+    event_dict = summary.count(min_count=0.001 * iterations)
+    logger.debug(f'{len(summary.events) - len(event_dict)} of {len(summary.events)} events are pruned')
+    return event_dict if event_dict else summary.count()
+
+
+def _ordered_counts(event_dict):
+    return [(cx, cy) if cx > cy else (cy, cx) for cx, cy in event_dict.values()]
+
+
+def _p_values(counts, epsilon, iterations):
+    # calculate p-values based on counts, all p-values are computed in one call sharing the log-factorial table, the
+    # events with too few outputs are not considered and get an infinite p-value
+    threshold = 0.001 * iterations * np.exp(epsilon)
+    all_cx, all_cy = np.asarray(counts, dtype=np.int64).reshape(-1, 2).T
+    candidates = all_cx + all_cy > threshold
+    p_values = np.full(len(counts), float('inf'))
+    p_values[candidates] = test_statistics_array(all_cx[candidates], all_cy[candidates], epsilon, iterations)
+    return p_values
+
+
+def _input_bounds(input_event_pairs):
+    """ Return the [(start, end), ...] of the events of each input in :input_event_pairs:, where the events of an input
+    are consecutive (consecutive identical inputs are taken as one). """
+    bounds, start = [], 0
+    for _, pairs in itertools.groupby(input_event_pairs, key=lambda pair: pair[:3]):
+        end = start + sum(1 for _ in pairs)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _rank_events(task, epsilon, iterations, top_k):
+    """ Compute the p-values of the (key, [(cx, cy), ...]) task in the worker and return (key, [(p, position), ...])
+    of the :top_k: events with the smallest p-values (all events if None), ties are broken by the position. """
+    key, counts = task
+    p_values = _p_values(counts, epsilon, iterations)
+    return key, [(float(p_values[position]), int(position))
+                 for position in np.argsort(p_values, kind='stable')[:top_k]]
+
+
+def sample_events(algorithm, input_list, iterations, process_pool, quiet=False, coverage=0.7, num_thresholds=10,
+                  seed=None):
+    """ Run the algorithm on each input and count the results falling into each event of the auto-generated search
+    space. The counts do not depend on the test epsilon, therefore they can be shared by `select_event` calls for
+    different epsilons. The iterations of each input are run in blocks (see `statdp.core.BLOCK_SIZE`), the search space
+    of an input is generated from its first block.
+    :param algorithm: The algorithm to run on.
+    :param input_list: list of (d1, d2, kwargs) input pair for the algorithm to run.
+    :param iterations: The iterations to run algorithms.
+    :param process_pool: The multiprocessing.Pool() to use, or any concurrent.futures.Executor, or None to run in the
+    current process.
+    :param quiet: Do not print progress bar or messages, logs are not affected, default is False.
+    :param coverage: The fraction of outputs the search space should cover for continuous outputs, default is 0.7.
+    :param num_thresholds: The number of events in the search space for continuous outputs, default is 10.
+    :param seed: The seed for running the algorithm (None, an int or a np.random.SeedSequence), each block of each
+    input runs with its own child seed.
+    :return: ([(cx, cy), ...], [(d1, d2, kwargs, event), ...]) The counts along with their input/event pairs.
+    """
+    if not callable(algorithm):
+        raise ValueError('Algorithm must be callable')
+
+    input_list = tuple(input_list)
+    progress = tqdm.tqdm(desc='Finding best inputs/events', total=len(input_list) * len(split_iterations(iterations)),
+                         unit='block', leave=False, disable=quiet)
+    samples = run_plan(_sample_events_plan(algorithm, input_list, iterations, coverage, num_thresholds, seed),
+                       process_pool, progress)
+    progress.close()
+    return samples
+
+
+def _sample_events_plan(algorithm, input_list, iterations, coverage, num_thresholds, seed):
+    # the plan of `sample_events`, see `run_plan`
+    block_iterations = split_iterations(iterations)
+    block_seeds = [spawn_seeds(input_seed, len(block_iterations)) for input_seed in spawn_seeds(seed, len(input_list))]
+
+    # fill in other arguments for _sample_block function, leaving out the task to be filled
+    partial_sample_block = functools.partial(_sample_block, algorithm=algorithm, coverage=coverage,
+                                             num_thresholds=num_thresholds, search_iterations=iterations)
+
+    # the first block of each input generates its search space and the layout of its summary
+    input_summaries = [None] * len(input_list)
+    _merge_blocks((yield partial_sample_block,
+                   [(index, input_triplet, block_iterations[0], block_seeds[index][0], None)
+                    for index, input_triplet in enumerate(input_list)]), input_summaries)
+
+    # the remaining blocks of all inputs are then summarized with the same layouts as small tasks of the same size, so
+    # that all processes are kept busy even with few inputs
+    layouts = [summary.layout for summary in input_summaries]
+    _merge_blocks((yield partial_sample_block,
+                   [(index, input_triplet, block_iterations[block], block_seeds[index][block], layouts[index])
+                    for block in range(1, len(block_iterations)) for index, input_triplet in enumerate(input_list)]),
+                  input_summaries)
+
+    # flatten the results for all input/event pairs, in the order of the inputs so that ties in p-values are broken
+    # the same way in each run
+    counts, input_event_pairs = [], []
+    for (d1, d2, kwargs), summary in zip(input_list, input_summaries):
+        event_dict = _summary_counts(summary, iterations)
+        counts.extend(_ordered_counts(event_dict))
+        input_event_pairs.extend((d1, d2, kwargs, event) for event in event_dict)
+    return counts, input_event_pairs
+
+
+def select_event(algorithm, input_list, epsilon, iterations, process_pool, quiet=False, samples=None, coverage=0.7,
+                 num_thresholds=10, seed=None):
     """
     :param algorithm: The algorithm to run on.
     :param input_list: list of (d1, d2, kwargs) input pair for the algorithm to run.
     :param epsilon: Test epsilon value.
     :param iterations: The iterations to run algorithms.
-    :param process_pool: The multiprocessing.Pool() to use.
+    :param process_pool: The multiprocessing.Pool() to use, or any concurrent.futures.Executor, or None to run in the
+    current process.
     :param quiet: Do not print progress bar or messages, logs are not affected, default is False.
+    :param samples: The (counts, input_event_pairs) returned by `sample_events` with the same :iterations:, if given,
+    the events are selected from these counts instead of running the algorithm again.
+    :param coverage: The fraction of outputs the search space should cover for continuous outputs, default is 0.7.
+    :param num_thresholds: The number of events in the search space for continuous outputs, default is 10.
+    :param seed: The seed for running the algorithm, see `sample_events`, not used if :samples: is given.
     :return: (d1, d2, kwargs, event) pair which has minimum p value from search space.
     """
     if not callable(algorithm):
         raise ValueError('Algorithm must be callable')
 
-    # fill in other arguments for _evaluate_input function, leaving out `input` to be filled
-    partial_evaluate_input = functools.partial(_evaluate_input, algorithm=algorithm, iterations=iterations)
+    input_list = tuple(input_list)
+    # the progress counts the blocks of iterations and the p-value tasks (one per input)
+    progress = tqdm.tqdm(desc='Finding best inputs/events', unit='block', leave=False, disable=quiet,
+                         total=len(input_list) * (1 if samples is not None else len(split_iterations(iterations)) + 1))
+    selected = run_plan(_select_event_plan(algorithm, input_list, epsilon, iterations, samples, coverage,
+                                           num_thresholds, seed), process_pool, progress)
+    progress.close()
+    return selected
 
-    threshold = 0.001 * iterations * np.exp(epsilon)
 
-    event_evaluator = tqdm.tqdm(process_pool.imap_unordered(partial_evaluate_input, input_list),
-                                desc='Finding best inputs/events', total=len(input_list), unit='input', leave=False,
-                                disable=quiet)
-    # flatten the results for all input/event pairs
-    counts, input_event_pairs, p_values = [], [], []
-    for local_counts, local_input_event_pair in event_evaluator:
-        # put the results in the list for later references
-        counts.extend(local_counts)
-        input_event_pairs.extend(local_input_event_pair)
+def _select_event_plan(algorithm, input_list, epsilon, iterations, samples, coverage, num_thresholds, seed):
+    # the plan of `select_event`, see `run_plan`
+    counts, input_event_pairs = samples if samples is not None else \
+        (yield from _sample_events_plan(algorithm, input_list, iterations, coverage, num_thresholds, seed))
 
-        # calculate p-values based on counts
-        for (cx, cy) in local_counts:
-            p_values.append(test_statistics(cx, cy, epsilon, iterations) if cx + cy > threshold else float('inf'))
+    # the p-values are computed by the workers on the events of each input, which only send back the best event of
+    # the input unless the full table is logged
+    debug = logger.isEnabledFor(logging.DEBUG)
+    rank_events = functools.partial(_rank_events, epsilon=epsilon, iterations=iterations, top_k=None if debug else 1)
+    ranked = yield rank_events, [(start, counts[start:end]) for start, end in _input_bounds(input_event_pairs)]
+    candidates = sorted((p, start + position) for start, chunk_ranks in ranked for p, position in chunk_ranks)
 
     # log the information for debug purposes
-    for ((d1, d2, kwargs, event), (cx, cy), p) in zip(input_event_pairs, counts, p_values):
-        logger.debug(f"d1: {d1} | d2: {d2} | kwargs: {kwargs} | event: {event} | p-value: {p:5.3f} | "
-                     f"cx: {cx} | cy: {cy} | ratio: {float(cy) / cx if cx != 0 else float('inf'):5.3f}")
+    if debug:
+        for p, position in sorted(candidates, key=lambda candidate: candidate[1]):
+            d1, d2, kwargs, event = input_event_pairs[position]
+            cx, cy = counts[position]
+            logger.debug(f"d1: {d1} | d2: {d2} | kwargs: {kwargs} | event: {event} | p-value: {p:5.3f} | "
+                         f"cx: {cx} | cy: {cy} | ratio: {float(cy) / cx if cx != 0 else float('inf'):5.3f}")
 
     # find an (d1, d2, kwargs, event) pair which has minimum p value from search space
-    return input_event_pairs[np.asarray(p_values).argmin()]
+    return input_event_pairs[candidates[0][1]]
+
+
+def select_event_halving(algorithm, input_list, epsilon, iterations, process_pool, quiet=False, coverage=0.7,
+                         num_thresholds=10, seed=None, eta=2):
+    """ Select the event with successive halving: the total budget of :iterations: per input is split into rounds,
+    all inputs are run with a small budget in the first round, then only the 1 / :eta: of the inputs with the smallest
+    p-values are kept for the next round, which gets the budget freed by the dropped inputs. The counts of an input are
+    accumulated over the rounds, and the event is selected from the inputs that survive the last round. There are
+    ceil(log_eta(len(input_list))) rounds, fewer if the budget of a round cannot run one block (BLOCK_SIZE iterations)
+    for each input. With a single round, e.g., for 2 inputs or a budget of less than 2 blocks per input, all inputs
+    run with the whole budget and the selection is the same as `select_event`, nothing is dropped.
+    :param algorithm: The algorithm to run on.
+    :param input_list: list of (d1, d2, kwargs) input pair for the algorithm to run.
+    :param epsilon: Test epsilon value.
+    :param iterations: The iterations per input, the total budget is :iterations: * len(input_list) rounded down to
+    whole blocks, but at least one block per input.
+    :param process_pool: The multiprocessing.Pool() to use, or any concurrent.futures.Executor, or None to run in the
+    current process.
+    :param quiet: Do not print progress bar or messages, logs are not affected, default is False.
+    :param coverage: The fraction of outputs the search space should cover for continuous outputs, default is 0.7.
+    :param num_thresholds: The number of events in the search space for continuous outputs, default is 10.
+    :param seed: The seed for running the algorithm (None, an int or a np.random.SeedSequence).
+    :param eta: The inverse of the fraction of inputs to keep after each round, default is 2.
+    :return: (d1, d2, kwargs, event) pair which has minimum p value from search space.
+    """
+    if not callable(algorithm):
+        raise ValueError('Algorithm must be callable')
+    if eta < 2:
+        raise ValueError(f'eta must be at least 2, got {eta}')
+
+    input_list = tuple(input_list)
+    schedule = _halving_schedule(len(input_list), iterations, eta)
+    # the progress counts the blocks of iterations and the p-value tasks (one per input in each round)
+    progress = tqdm.tqdm(desc='Finding best inputs/events', unit='block', leave=False, disable=quiet,
+                         total=sum(number * (blocks + 1) for number, blocks in schedule))
+    selected = run_plan(_select_event_halving_plan(algorithm, input_list, epsilon, iterations, coverage,
+                                                   num_thresholds, seed, eta), process_pool, progress)
+    progress.close()
+    return selected
+
+
+def _halving_schedule(input_number, iterations, eta):
+    """ Return the [(number of inputs, blocks per input), ...] of the rounds of `select_event_halving`. """
+    # the budget in blocks, every input runs at least one block (which generates its search space)
+    budget = max(iterations * input_number // BLOCK_SIZE, input_number)
+    # each round gets an equal share of the budget, which must fund at least one block per input of the first round,
+    # the last rounds are dropped otherwise (a single round runs all inputs with the whole budget like `select_event`)
+    rounds = max(min(math.ceil(math.log(input_number, eta)), budget // input_number), 1)
+
+    schedule, survivor_number = [], input_number
+    for _ in range(rounds):
+        schedule.append((survivor_number, budget // rounds // survivor_number))
+        survivor_number = math.ceil(survivor_number / eta)
+    return schedule
+
+
+def _select_event_halving_plan(algorithm, input_list, epsilon, iterations, coverage, num_thresholds, seed, eta):
+    # the plan of `select_event_halving`, see `run_plan`
+    schedule = _halving_schedule(len(input_list), iterations, eta)
+
+    # each input draws the seeds of its blocks one after another from its own child seed
+    input_seeds = spawn_seeds(seed, len(input_list))
+    input_summaries, input_blocks = [None] * len(input_list), [0] * len(input_list)
+    partial_sample_block = functools.partial(_sample_block, algorithm=algorithm, coverage=coverage,
+                                             num_thresholds=num_thresholds, search_iterations=iterations)
+
+    survivors = list(range(len(input_list)))
+    for round_number, (survivor_number, blocks) in enumerate(schedule):
+        survivors = survivors[:survivor_number]
+        round_seeds = {index: input_seeds[index].spawn(blocks) for index in survivors}
+        # the first block of an input generates its search space
+        _merge_blocks((yield partial_sample_block,
+                       [(index, input_list[index], BLOCK_SIZE, round_seeds[index].pop(0), None)
+                        for index in survivors if input_summaries[index] is None]), input_summaries)
+        _merge_blocks((yield partial_sample_block,
+                       [(index, input_list[index], BLOCK_SIZE, seed, input_summaries[index].layout)
+                        for index in survivors for seed in round_seeds[index]]), input_summaries)
+        for index in survivors:
+            input_blocks[index] += blocks
+
+        # rank the survivors by their best p-values, the ties are broken by the order of the inputs
+        # all survivors have run the same iterations in this round, their p-values are computed by the workers
+        round_iterations = input_blocks[survivors[0]] * BLOCK_SIZE
+        event_dicts = {index: _summary_counts(input_summaries[index], round_iterations) for index in survivors}
+        rank_events = functools.partial(_rank_events, epsilon=epsilon, iterations=round_iterations, top_k=1)
+        ranked = yield rank_events, [(index, _ordered_counts(event_dicts[index])) for index in survivors]
+        best_events = {index: tuple(event_dicts[index])[chunk_ranks[0][1]] for index, chunk_ranks in ranked}
+        best_p_values = {index: chunk_ranks[0][0] for index, chunk_ranks in ranked}
+        survivors.sort(key=lambda index: (best_p_values[index], index))
+        logger.debug(f'round {round_number} | blocks per input: {blocks} | best p-values: '
+                     f'{[best_p_values[index] for index in survivors]}')
+
+    # the (d1, d2, kwargs, event) with minimum p value among the remaining survivors
+    d1, d2, kwargs = input_list[survivors[0]]
+    return d1, d2, kwargs, best_events[survivors[0]]
@@ -0,0 +1,224 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+""" Compact, mergeable summaries of the outputs of an algorithm on d1 and d2, which the events are counted on instead
+of the raw output arrays. Each return value (column) of the outputs is summarized either by its values (categorical
+outputs), or by a fixed-resolution histogram (continuous outputs) whose bin edges are the quantiles of the outputs of
+the first iterations (a quantile sketch, see `statdp.core.SEARCH_SPACE_ITERATIONS`) along with the endpoints of the
+events in the search space, so that the events of the search space are counted exactly. The summary of an input is a
+table of the distinct cells (one coordinate per column) with their counts for d1 and d2, its size does not grow with
+the iterations.
+"""
+import numpy as np
+
+from statdp.core import _is_categorical, _joint_counts, _possible_events, _run_pieces, SEARCH_SPACE_ITERATIONS
+
+# the number of bin edges at the quantiles of the outputs of a continuous column (in addition to the endpoints of the
+# events), the count of an event whose endpoints are not bin edges is off by at most about 2 / RESOLUTION of the outputs
+RESOLUTION = 256
+
+
+def _generate_layout(events, result_d1, result_d2, resolution):
+    """ Determine how the outputs of each column are summarized for the given events.
+    :return: (events, [None for categorical columns or the sorted bin edges of continuous columns, ...])
+    """
+    column_edges = []
+    for row in range(len(result_d1)):
+        components = {event[row] for event in events}
+        if all(_is_categorical(component) for component in components):
+            column_edges.append(None)
+            continue
+        endpoints = np.asarray([value for component in components
+                                for value in ((component, ) if _is_categorical(component) else component)],
+                               dtype=np.float64)
+        outputs = np.concatenate((result_d1[row], result_d2[row])).astype(np.float64)
+        finite = outputs[np.isfinite(outputs)]
+        # the edges are at the quantiles of the outputs, so that each bin holds about the same number of outputs
+        grid = np.unique(np.quantile(finite, np.linspace(0, 1, resolution))) if len(finite) > 0 else ()
+        column_edges.append(np.unique(np.concatenate((endpoints, grid))))
+    return tuple(events), tuple(column_edges)
+
+
+def _coordinates(edges, column):
+    # the outputs of a categorical column are kept as they are, the outputs of a continuous column are mapped to the
+    # "atoms" of its edges e_0 < e_1 < ...: atom 2i + 1 contains the outputs equal to e_i and atom 2i the outputs
+    # strictly between e_(i-1) and e_i (see `statdp.core._bin_columns`)
+    if edges is None:
+        return np.asarray(column, dtype=np.float64)
+    # instead of looking up every output in the edges, the outputs are sorted and the edges are looked up in them,
+    # which gives the range of each atom in the sorted outputs
+    order = np.argsort(column)
+    sorted_column = column[order]
+    bounds = np.empty(2 * len(edges) + 2, dtype=np.int64)
+    bounds[0], bounds[-1] = 0, len(column)
+    bounds[1:-1:2] = np.searchsorted(sorted_column, edges, side='left')
+    bounds[2:-1:2] = np.searchsorted(sorted_column, edges, side='right')
+    coordinates = np.empty(len(column), dtype=np.float64)
+    coordinates[order] = np.repeat(np.arange(2 * len(edges) + 1, dtype=np.float64), np.diff(bounds))
+    return coordinates
+
+
+def _coordinate_component(edges, component):
+    # the event component on the coordinates of the cells, which covers exactly the cells falling into the component
+    # for categorical columns and for components whose values / endpoints are edges, otherwise the atoms partially
+    # covered by the component are included
+    if edges is None:
+        return component
+    if _is_categorical(component):
+        return float(np.searchsorted(edges, component, side='left') + np.searchsorted(edges, component, side='right'))
+    lower, upper = component
+    # the atoms first, ..., last as an open interval of the coordinates
+    first = 2 * np.searchsorted(edges, lower, side='right')
+    last = 2 * np.searchsorted(edges, upper, side='left')
+    return first - 0.5, last + 0.5
+
+
+class Summary:
+    """ The summary of the outputs of an algorithm on d1 and d2, see `summarize_outputs`. The summaries of different
+    runs with the same layout can be merged, and the summary can be queried for any events with `count`.
+    """
+
+    def __init__(self, layout, cells, counts_d1, counts_d2):
+        """
+        :param layout: (events, column_edges), the events of the search space and how each column is summarized.
+        :param cells: The (number of cells, number of columns) array of the distinct cells.
+        :param counts_d1: The number of outputs of d1 in each cell.
+        :param counts_d2: The number of outputs of d2 in each cell.
+        """
+        self.layout = layout
+        self.cells = cells
+        self.counts_d1 = counts_d1
+        self.counts_d2 = counts_d2
+
+    @property
+    def events(self):
+        """ The events of the search space the summary is laid out for. """
+        return self.layout[0]
+
+    @classmethod
+    def _from_cells(cls, layout, cells, weights_d1, weights_d2):
+        # combine the duplicate cells: the cells are numbered by the flat index of their value numbers in each column
+        # (the atoms of continuous columns, the distinct values of categorical columns), then counted with bincount
+        # if there are not many possible cells, which is much faster than finding the unique rows of the cells
+        _, column_edges = layout
+        columns = [np.unique(column, return_inverse=True) if edges is None else
+                   (np.arange(2 * len(edges) + 1, dtype=np.float64), column.astype(np.int64))
+                   for edges, column in zip(column_edges, cells.T)]
+        dimensions = [len(values) for values, _ in columns]
+        possible_cells = np.prod(dimensions, dtype=np.float64)
+        if possible_cells >= 2 ** 62:
+            cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            return cls(layout, cells, np.bincount(inverse, weights=weights_d1, minlength=len(cells)).astype(np.int64),
+                       np.bincount(inverse, weights=weights_d2, minlength=len(cells)).astype(np.int64))
+
+        keys = np.ravel_multi_index([value_numbers.reshape(-1) for _, value_numbers in columns], dimensions)
+        if possible_cells <= max(4 * len(keys), 1024):
+            counts_d1, counts_d2 = (np.bincount(keys, weights=weights, minlength=int(possible_cells))
+                                    for weights in (weights_d1, weights_d2))
+            keys = np.flatnonzero(counts_d1 + counts_d2)
+            counts_d1, counts_d2 = counts_d1[keys], counts_d2[keys]
+        else:
+            keys, inverse = np.unique(keys, return_inverse=True)
+            counts_d1, counts_d2 = (np.bincount(inverse.reshape(-1), weights=weights, minlength=len(keys))
+                                    for weights in (weights_d1, weights_d2))
+        cells = np.column_stack([values[value_numbers] for (values, _), value_numbers in
+                                 zip(columns, np.unravel_index(keys, dimensions))]).reshape(-1, len(columns))
+        return cls(layout, cells, counts_d1.astype(np.int64), counts_d2.astype(np.int64))
+
+    @classmethod
+    def from_outputs(cls, layout, result_d1, result_d2):
+        """ Summarize the outputs, each return value is stored as a row of :result_d1: / :result_d2:. """
+        _, column_edges = layout
+        cells = np.concatenate([np.column_stack([_coordinates(edges, row) for edges, row in zip(column_edges, result)])
+                                for result in (result_d1, result_d2)])
+        size_d1, size_d2 = len(result_d1[0]), len(result_d2[0])
+        return cls._from_cells(layout, cells, np.concatenate((np.ones(size_d1), np.zeros(size_d2))),
+                               np.concatenate((np.zeros(size_d1), np.ones(size_d2))))
+
+    def merge(self, other):
+        """ Merge with the summary of another run with the same layout.
+        :return: The merged Summary.
+        """
+        return self._from_cells(self.layout, np.concatenate((self.cells, other.cells)),
+                                np.concatenate((self.counts_d1, other.counts_d1)),
+                                np.concatenate((self.counts_d2, other.counts_d2)))
+
+    def count(self, events=None, min_count=None):
+        """ Count the outputs falling into each event, the counts of the search space events are exact.
+        :param events: The events to count, the events of the search space if None.
+        :param min_count: If given, the events with a component holding at most :min_count: outputs of d1 and d2 are
+        left out, these events cannot hold more than :min_count: outputs either (see `statdp.core._joint_counts`).
+        :return: {event: (cx, cy)} The counts of d1 / d2 for each event.
+        """
+        events = self.events if events is None else tuple(events)
+        _, column_edges = self.layout
+        # the events are counted on the coordinates of the cells, weighted by the counts of d1 / d2 of the cells
+        coordinate_components = [{component: _coordinate_component(edges, component)
+                                  for component in {event[row] for event in events}}
+                                 for row, edges in enumerate(column_edges)]
+        coordinate_events = [tuple(coordinate_components[row][component] for row, component in enumerate(event))
+                             for event in events]
+        counted_events, counts = _joint_counts(((self.cells.T, self.counts_d1), (self.cells.T, self.counts_d2)),
+                                               dict.fromkeys(coordinate_events), min_count=min_count)
+        # different events may cover the same cells, e.g., events with endpoints in the same bin
+        event_counts = dict(zip(counted_events, counts))
+        return {event: event_counts[coordinate_event] for event, coordinate_event in zip(events, coordinate_events)
+                if coordinate_event in event_counts}
+
+
+def summarize_outputs(algorithm, d1, d2, kwargs, total_iterations, layout=None, coverage=0.7, num_thresholds=10,
+                      resolution=RESOLUTION, seed=None, memory_budget=None, search_iterations=None):
+    """ Run the algorithm for :total_iterations: times and summarize the outputs of d1 and d2, the raw outputs are only
+    kept for one piece of iterations at a time (see `statdp.core.count_events`).
+    :param algorithm: The algorithm to run.
+    :param d1: The D1 input to run.
+    :param d2: The D2 input to run.
+    :param kwargs: The keyword arguments for the algorithm.
+    :param total_iterations: The iterations to run, at least 1.
+    :param layout: The layout of a previous summary (`Summary.layout`) to merge with, or None to generate the search
+    space and the layout from the outputs of the first SEARCH_SPACE_ITERATIONS iterations.
+    :param coverage: The fraction of outputs the auto-generated search space should cover for continuous outputs.
+    :param num_thresholds: The number of events in the auto-generated search space for continuous outputs.
+    :param resolution: The number of bin edges over the range of the outputs of continuous columns.
+    :param seed: The seed for the random generator passed to the algorithm, see `statdp.core.spawn_seeds`.
+    :param memory_budget: The memory (in bytes) for the outputs of a piece, see `statdp.core.count_events`.
+    :param search_iterations: The iterations the search space is generated for, e.g., the total iterations of all
+    blocks of an input summarized one block at a time, which decide if an output is categorical (see
+    `statdp.core._generate_search_space`). :total_iterations: is used if None.
+    :return: The Summary of the outputs.
+    """
+    if not callable(algorithm):
+        raise ValueError('Algorithm must be callable')
+    if total_iterations < 1:
+        raise ValueError(f'total_iterations must be at least 1, got {total_iterations}')
+    prng = np.random.default_rng(seed)
+    summary = None
+    first_piece = SEARCH_SPACE_ITERATIONS if layout is None else 0
+    for result_d1, result_d2 in _run_pieces(algorithm, d1, d2, kwargs, total_iterations, prng, memory_budget,
+                                            first_piece):
+        if layout is None:
+            events = _possible_events(result_d1, result_d2, None, coverage, num_thresholds,
+                                      total_iterations if search_iterations is None else search_iterations)
+            layout = _generate_layout(events, result_d1, result_d2, resolution)
+        piece_summary = Summary.from_outputs(layout, result_d1, result_d2)
+        summary = piece_summary if summary is None else summary.merge(piece_summary)
+    return summary
@@ -0,0 +1,103 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import concurrent.futures
+import threading
+import pytest
+from statdp import AsyncDetector, Detector
+from statdp.aio import _FairScheduler
+from statdp.algorithms import noisy_max_v1a, SVT
+
+
+def test_async_detector():
+    kwargs = {'epsilon': 0.7, 'N': 1, 'T': 0.5}
+
+    async def detect():
+        async with AsyncDetector(2, executor='thread') as detector:
+            return await asyncio.gather(
+                detector.detect(noisy_max_v1a, (0.5, 1.0), {'epsilon': 0.7}, num_input=5, event_iterations=20000,
+                                detect_iterations=20000, seed=1),
+                detector.detect(SVT, 0.5, kwargs, num_input=5, event_iterations=20000, detect_iterations=20000,
+                                seed=2, alpha=0.05))
+
+    results = asyncio.run(detect())
+    # the concurrent detections give the same results as the synchronous ones
+    with Detector(2, executor='thread') as detector:
+        assert results[0] == detector.detect(noisy_max_v1a, (0.5, 1.0), {'epsilon': 0.7}, num_input=5,
+                                             event_iterations=20000, detect_iterations=20000, quiet=True, seed=1)
+        assert results[1] == detector.detect(SVT, 0.5, kwargs, num_input=5, event_iterations=20000,
+                                             detect_iterations=20000, quiet=True, seed=2, alpha=0.05)
+    with pytest.raises(ValueError):
+        AsyncDetector(executor='serial')
+
+
+def test_fair_scheduler():
+    order = []
+
+    async def run():
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            scheduler = _FairScheduler(executor, 1)
+            futures = [scheduler.submit(job, order.append, f'{job}{index}') for job in 'ab' for index in range(3)]
+            await asyncio.gather(*futures)
+            # the waiting tasks of a cancelled job are withdrawn
+            futures = [scheduler.submit('c', order.append, f'c{index}') for index in range(3)]
+            scheduler.cancel('c')
+            await asyncio.gather(*futures, return_exceptions=True)
+            return futures
+
+    futures = asyncio.run(run())
+    # the tasks of the jobs take turns, except the first task which starts as soon as it is submitted
+    assert order == ['a0', 'a1', 'b0', 'a2', 'b1', 'b2', 'c0']
+    assert [future.cancelled() for future in futures] == [False, True, True]
+
+
+def test_cancel():
+    async def cancel():
+        async with AsyncDetector(1, executor='thread') as detector:
+            detection = asyncio.ensure_future(detector.detect(noisy_max_v1a, 0.5, {'epsilon': 0.7}, num_input=5,
+                                                              event_iterations=20000, detect_iterations=10000000))
+            await asyncio.sleep(0.5)
+            detection.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await detection
+            # only the tasks already running are left
+            assert not detector._scheduler._waiting and detector._scheduler._running <= detector.max_tasks
+
+    asyncio.run(cancel())
+
+
+def test_plan_steps_off_loop():
+    threads = []
+
+    def plan():
+        threads.append(threading.get_ident())
+        results = yield abs, [-1, -2]
+        threads.append(threading.get_ident())
+        return results
+
+    async def run():
+        async with AsyncDetector(1, executor='thread') as detector:
+            return await detector._run(object(), plan())
+
+    # the steps of the plan do not run on the event loop thread
+    assert asyncio.run(run()) == [1, 2]
+    assert len(threads) == 2 and threading.get_ident() not in threads
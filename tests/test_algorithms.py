@@ -21,7 +21,7 @@
 # SOFTWARE.
 import numpy as np
 from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, noisy_max_v2a, noisy_max_v2b, SVT, iSVT1,\
-    iSVT2, iSVT3, iSVT4, histogram, histogram_eps
+    iSVT2, iSVT3, iSVT4, histogram, histogram_eps, SVT_numba, iSVT1_numba, iSVT2_numba, iSVT3_numba, iSVT4_numba
 
 _prng = np.random.default_rng()
 
@@ -34,6 +34,15 @@ def test_noisymax():
     assert noisy_max_v2b(_prng, [1, 3, 1], float('inf')) == 3
 
 
+def test_batched_noisymax():
+    for algorithm in (noisy_max_v1a, noisy_max_v1b, noisy_max_v2a, noisy_max_v2b):
+        assert algorithm(_prng, [1, 2, 1], 0.5, size=100).shape == (100, )
+    assert np.all(noisy_max_v1a(_prng, [1, 2, 1], float('inf'), size=10) == 1)
+    assert np.all(noisy_max_v1b(_prng, [1, 3, 1], float('inf'), size=10) == 3)
+    assert np.all(noisy_max_v2a(_prng, [1, 3, 1], float('inf'), size=10) == 1)
+    assert np.all(noisy_max_v2b(_prng, [1, 3, 1], float('inf'), size=10) == 3)
+
+
 def test_sparsevector():
     assert SVT(_prng, [1, 2, 3, 4], float('inf'), 1, 2.5) == 2
     assert iSVT1(_prng, [1, 2, 3, 4], float('inf'), 1, 1.5) == 3
@@ -52,3 +61,21 @@ def test_histogram():
     assert isinstance(histogram(_prng, [1, 2], 1), float)
     assert histogram_eps(_prng, [1, 2], 0) == 1
     assert isinstance(histogram_eps(_prng, [1, 2], 1), float)
+
+
+def test_batched_histogram():
+    assert np.all(histogram(_prng, [1, 2], float('inf'), size=10) == 1)
+    assert histogram(_prng, [1, 2], 1, size=10).shape == (10, )
+    assert np.all(histogram_eps(_prng, [1, 2], 0, size=10) == 1)
+    assert histogram_eps(_prng, [1, 2], 1, size=10).shape == (10, )
+
+
+def test_sparsevector_numba():
+    queries = [1, 1, 1, 1, 1, 2, 2, 2, 2, 2]
+    # the compiled versions draw the same noise from the generator, therefore give the same outputs
+    for algorithm, compiled in ((SVT, SVT_numba), (iSVT1, iSVT1_numba), (iSVT2, iSVT2_numba), (iSVT3, iSVT3_numba),
+                                (iSVT4, iSVT4_numba)):
+        for N in (1, 2):
+            for seed in range(20):
+                assert algorithm(np.random.default_rng(seed), queries, 0.7, N, 1.0) == \
+                       compiled(np.random.default_rng(seed), np.asarray(queries), 0.7, N, 1.0)
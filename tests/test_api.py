@@ -20,6 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import logging
+import os
+import subprocess
+import sys
 import pytest
 from flaky import flaky
 from statdp.algorithms import (SVT, iSVT1, iSVT2, iSVT3, iSVT4, noisy_max_v1a,
@@ -81,3 +84,40 @@ def test_large_iterations():
                                    event_iterations=int(2e6), detect_iterations=int(5e6))
     epsilon, p, *extras = result[0]
     assert p >= 0.05, 'epsilon: {}, p-value: {} is not expected. extra info: {}'.format(epsilon, p, extras)
+
+
+# the budget of `import statdp` in a fresh interpreter, relative to the time of `import numpy` in the same interpreter
+# (statdp does not import numpy), so that the check does not depend on the speed or the load of the machine
+IMPORT_TIME_RATIO = 1.0
+
+
+def test_import_time(tmp_path):
+    # the heavy dependencies are only imported on first use (see `statdp.__getattr__`)
+    script = ('import sys, time\n'
+              'start = time.perf_counter()\n'
+              'import statdp\n'
+              'print(time.perf_counter() - start)\n'
+              'print(sorted(module for module in ("numba", "numpy", "tqdm", "asyncio") if module in sys.modules))\n'
+              'start = time.perf_counter()\n'
+              'import numpy\n'
+              'print(time.perf_counter() - start)')
+    import_times = []
+    # the best of a few runs, which leaves out the noise of a busy machine
+    for _ in range(3):
+        import_time, heavy_modules, numpy_time = subprocess.run(
+            [sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout.splitlines()
+        assert heavy_modules == '[]'
+        import_times.append((float(import_time), float(numpy_time)))
+    assert min(statdp_time for statdp_time, _ in import_times) < \
+        IMPORT_TIME_RATIO * min(numpy_time for _, numpy_time in import_times)
+
+    # the numba kernels are cached on disk on the first compile, so that they are compiled once instead of in every
+    # process
+    script = ('import numpy as np\n'
+              'from statdp.hypotest import test_statistics, test_statistics_array\n'
+              'test_statistics(1, 0, 1.0, 2, False)\n'
+              'test_statistics_array(np.ones(1, dtype=np.int64), np.zeros(1, dtype=np.int64), 1.0, 2)')
+    subprocess.run([sys.executable, '-c', script], check=True, env=dict(os.environ, NUMBA_CACHE_DIR=str(tmp_path)))
+    cached = [path.name for path in tmp_path.rglob('*.nbi')]
+    assert any(name.startswith('hypotest.') for name in cached)
+    assert any(name.startswith('_hypergeom.') for name in cached)
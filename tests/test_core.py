@@ -0,0 +1,241 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import itertools
+import tracemalloc
+import numpy as np
+import pytest
+from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, histogram, SVT, iSVT4, SVT_numba, iSVT4_numba
+from statdp.core import BufferedGenerator, buffered_draws, is_batched, run_algorithm, count_events, split_iterations, \
+    run_plan, run_plans, _count_outputs, _densest_range
+
+
+def test_buffered_generator():
+    draws = []
+    for _ in range(2):
+        prng = BufferedGenerator(np.random.default_rng(0), buffer_size=1000)
+        draws.append([(prng.laplace(scale=2.0), prng.laplace(1.0, 0.5), prng.exponential(scale=3.0),
+                       prng.normal(-1.0, 2.0)) for _ in range(20000)])
+    # the draws are reproducible from the seed and follow the distributions of the generator
+    assert draws[0] == draws[1]
+    laplace, shifted_laplace, exponential, normal = np.asarray(draws[0]).T
+    assert np.isclose(np.mean(laplace), 0, atol=0.1) and np.isclose(np.var(laplace), 8, rtol=0.1)
+    assert np.isclose(np.median(shifted_laplace), 1, atol=0.05) and np.isclose(np.var(shifted_laplace), 0.5, rtol=0.1)
+    assert np.isclose(np.mean(exponential), 3, rtol=0.05) and np.isclose(np.var(exponential), 9, rtol=0.1)
+    assert np.isclose(np.mean(normal), -1, atol=0.1) and np.isclose(np.var(normal), 4, rtol=0.1)
+    # the other draws are passed on to the generator
+    assert prng.laplace(scale=2.0, size=3).shape == (3, )
+    assert prng.normal([0.0, 1.0]).shape == (2, )
+    assert 0 <= prng.integers(10) < 10
+    with pytest.raises(ValueError):
+        prng.laplace(scale=-1.0)
+
+    # only the algorithms opted in get the buffered generator
+    generator_types = []
+
+    def generator_type(prng, queries, epsilon):
+        generator_types.append(type(prng))
+        return prng.laplace(scale=1.0 / epsilon)
+
+    count_events(generator_type, [1], [1], {'epsilon': 1}, None, 10)
+    assert set(generator_types) == {np.random.Generator}
+    generator_types.clear()
+    count_events(buffered_draws(generator_type), [1], [1], {'epsilon': 1}, None, 10)
+    assert set(generator_types) == {BufferedGenerator}
+
+
+def test_is_batched():
+    assert is_batched(noisy_max_v1a)
+    assert is_batched(histogram)
+    assert not is_batched(SVT)
+    assert not is_batched(iSVT4)
+
+
+def test_run_algorithm_batched():
+    d1, d2 = [1, 2, 1], [2, 1, 1]
+    # no noise is added, so the outputs are deterministic
+    counts, input_event_pairs = run_algorithm(noisy_max_v1a, d1, d2, {'epsilon': float('inf')}, None, 10000)
+    assert dict(zip((event for *_, event in input_event_pairs), counts)) == {(0,): (10000, 0), (1,): (10000, 0)}
+    counts, _ = run_algorithm(noisy_max_v1a, d1, d2, {'epsilon': float('inf')}, (1,), 1000)
+    assert counts == [(1000, 0)]
+    counts, _ = run_algorithm(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, ((-float('inf'), float('inf')),), 1000)
+    assert counts == [(1000, 1000)]
+
+
+def test_run_algorithm_batched_shape():
+    def wrong_shape(prng, queries, epsilon, size=None):
+        return prng.laplace(scale=1.0 / epsilon, size=(size, len(queries)))
+
+    with pytest.raises(ValueError):
+        run_algorithm(wrong_shape, [1, 2], [2, 1], {'epsilon': 0.5}, None, 100)
+
+
+def _count_outputs_reference(result_d1, result_d2, events):
+    # check every event against the full output arrays
+    counts = []
+    for event in events:
+        cx_check, cy_check = np.full(len(result_d1[0]), True), np.full(len(result_d2[0]), True)
+        for row, component in enumerate(event):
+            if isinstance(component, tuple):
+                cx_check &= (result_d1[row] > component[0]) & (result_d1[row] < component[1])
+                cy_check &= (result_d2[row] > component[0]) & (result_d2[row] < component[1])
+            else:
+                cx_check &= result_d1[row] == component
+                cy_check &= result_d2[row] == component
+        counts.append((np.count_nonzero(cx_check), np.count_nonzero(cy_check)))
+    return counts
+
+
+def test_count_outputs():
+    prng = np.random.default_rng(0)
+    categorical_d1, categorical_d2 = prng.integers(0, 5, size=10000), prng.integers(0, 5, size=10000)
+    continuous_d1, continuous_d2 = np.round(prng.normal(size=10000), 1), np.round(prng.normal(size=10000), 1)
+    # outputs which are not comparable / at infinity should not be counted in any (-inf, alpha) event
+    continuous_d1[:3] = np.nan, float('inf'), -float('inf')
+    categorical_space = (0, 2, 4, 6)
+    continuous_space = tuple((-float('inf'), alpha) for alpha in (-1.0, 0.0, 0.5, 0.5, float('inf'))) + \
+        ((0.5, -0.5), (-0.5, 0.5))
+    for result_d1, result_d2, search_space in (
+            ((categorical_d1, ), (categorical_d2, ), (categorical_space, )),
+            ((continuous_d1, ), (continuous_d2, ), (continuous_space, )),
+            ((categorical_d1, continuous_d1), (categorical_d2, continuous_d2), (categorical_space, continuous_space)),
+            ((continuous_d1, categorical_d1, continuous_d1), (continuous_d2, categorical_d2, continuous_d2),
+             (continuous_space, categorical_space, continuous_space))):
+        events = tuple(itertools.product(*search_space))
+        assert _count_outputs(result_d1, result_d2, events) == _count_outputs_reference(result_d1, result_d2, events)
+
+
+def test_densest_range():
+    prng = np.random.default_rng(0)
+    sorted_result = np.sort(prng.laplace(size=1000))
+    for coverage in (0.1, 0.5, 0.7, 0.9):
+        search_range = int(coverage * len(sorted_result))
+        search_max = min(range(search_range, len(sorted_result)),
+                         key=lambda x: sorted_result[x] - sorted_result[x - search_range])
+        assert _densest_range(sorted_result, coverage) == (search_max - search_range, search_max)
+    assert _densest_range(sorted_result, 1.0) == (0, len(sorted_result) - 1)
+
+
+def test_search_space_options():
+    counts, input_event_pairs = run_algorithm(noisy_max_v1b, [1, 2, 1], [2, 1, 1], {'epsilon': 0.5}, None, 10000,
+                                              coverage=0.5, num_thresholds=5)
+    assert len(counts) == len(input_event_pairs) == 5
+    alphas = [event[0][1] for *_, event in input_event_pairs]
+    assert alphas == sorted(alphas)
+
+
+def test_split_iterations():
+    assert split_iterations(25, 10) == [10, 10, 5]
+    assert split_iterations(20, 10) == [10, 10]
+    assert split_iterations(5, 10) == [5]
+    assert split_iterations(0, 10) == []
+
+
+def test_seed():
+    d1, d2 = [1, 2, 1], [2, 1, 1]
+    for algorithm in (noisy_max_v1b, SVT):
+        kwargs = {'epsilon': 0.5, 'N': 1, 'T': 0.5} if algorithm is SVT else {'epsilon': 0.5}
+        counts = [run_algorithm(algorithm, d1, d2, kwargs, None, 10000, seed=seed) for seed in (0, 0, 1)]
+        assert counts[0] == counts[1]
+        assert counts[0] != counts[2]
+    # the raw counts are not re-ordered
+    event_dict = count_events(noisy_max_v1a, d1, d2, {'epsilon': float('inf')}, (1, ), 100, seed=0)
+    assert event_dict == {(1, ): (100, 0)}
+
+
+def test_count_events_given_events():
+    events = ((2, ), (0, ), (1, ))
+    event_dict = count_events(noisy_max_v1a, [1, 2, 1], [2, 1, 1], {'epsilon': 0.5}, None, 1000, events=events)
+    assert tuple(event_dict) == events
+    assert sum(cx for cx, _ in event_dict.values()) == sum(cy for _, cy in event_dict.values()) == 1000
+
+
+def test_count_events_many_categories():
+    # with a small budget the search space is generated from the first SEARCH_SPACE_ITERATIONS iterations, but an output
+    # is categorical by its distinct values relative to all iterations (30 indices are over 0.2% of the first ones)
+    event_dict = count_events(noisy_max_v1a, [0] * 30, [0] * 30, {'epsilon': 0.5}, None, 20000, seed=0,
+                              memory_budget=16 * 5000)
+    assert sorted(event_dict) == [(index, ) for index in range(30)]
+
+
+def test_count_events_output_types():
+    # the last value of iSVT4 is False in the first run with this seed, but a float in most other runs
+    event_dict = count_events(iSVT4, [1] * 5, [0] * 5, {'epsilon': 0.7, 'N': 1, 'T': 0.5}, None, 2000, seed=1)
+    assert all(isinstance(event[1], tuple) for event in event_dict)
+    assert len({event[1] for event in event_dict}) == 10
+
+
+def test_run_algorithm_compiled():
+    d1, d2 = [1, 2, 1], [2, 1, 1]
+    kwargs = {'epsilon': 0.5, 'N': 1, 'T': 0.5}
+    # the compiled loop draws the same noise as the python loop
+    assert run_algorithm(SVT_numba, d1, d2, kwargs, None, 10000, seed=0) == \
+        run_algorithm(SVT, d1, d2, kwargs, None, 10000, seed=0)
+    # multiple return values of different types
+    counts, input_event_pairs = run_algorithm(iSVT4_numba, d1, d2, kwargs, None, 10000, seed=0)
+    assert len(counts) == len(input_event_pairs) > 1
+    assert all(len(event) == 2 for *_, event in input_event_pairs)
+
+
+def _square_plan(numbers):
+    squares = yield abs, [-number for number in numbers]
+    # empty batches are skipped
+    yield abs, []
+    roots = yield np.sqrt, [square ** 2 for square in squares]
+    return sorted(float(root) for root in roots)
+
+
+def test_run_plans():
+    assert run_plan(_square_plan([1, 2, 3]), None) == [1, 2, 3]
+    plans = [_square_plan(range(index + 1)) for index in range(4)]
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        task_times = []
+        results = dict(run_plans(plans, executor, window=2, task_times=task_times))
+    assert results == {index: list(range(index + 1)) for index in range(4)}
+    assert len(task_times) == 2 * (1 + 2 + 3 + 4)
+    # plans finishing without tasks
+    assert list(run_plans([_square_plan([])], None)) == [(0, [])]
+
+
+def test_memory_budget():
+    d1, d2 = [1, 2, 1], [2, 1, 1]
+    kwargs = {'epsilon': 0.5, 'N': 1, 'T': 0.5}
+    # pieces of 1000 iterations, including an exact multiple of the piece size which has no empty last piece
+    for algorithm, options in ((noisy_max_v1b, {'epsilon': 0.5}), (noisy_max_v1a, {'epsilon': 0.5}),
+                               (SVT, kwargs), (SVT_numba, kwargs)):
+        for iterations in (2000, 2500):
+            counts = run_algorithm(algorithm, d1, d2, options, None, iterations, seed=0, memory_budget=16 * 1000)[0]
+            assert all(cx <= iterations and cy <= iterations for cx, cy in counts)
+    event = ((-float('inf'), float('inf')), )
+    assert count_events(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, event, 2500, memory_budget=16 * 1000) == \
+        {event: (2500, 2500)}
+    assert count_events(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, event, 0) == {}
+
+    # the peak memory does not grow with the iterations (after compiling the algorithm)
+    count_events(SVT_numba, d1, d2, kwargs, None, 1000, seed=0)
+    peaks = []
+    for iterations in (20000, 80000):
+        tracemalloc.start()
+        count_events(SVT_numba, d1, d2, kwargs, None, iterations, seed=0, memory_budget=16 * 5000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 1.5 * peaks[0]
@@ -0,0 +1,102 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import multiprocessing as mp
+import pytest
+from statdp import Detector, detect_counterexample
+from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, SVT_numba
+from statdp.hypotest import hypothesis_test
+
+
+def test_detector():
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    with Detector(2) as detector:
+        executor = detector.executor
+        results = [detector.detect(algorithm, (0.5, 1.0), {'epsilon': 0.7}, num_input=5, event_iterations=20000,
+                                   detect_iterations=20000, quiet=True, seed=1)
+                   for algorithm in (noisy_max_v1a, noisy_max_v1b)]
+        # the workers are reused by all detections
+        assert detector.executor is executor
+        assert all(len(result) == 2 for result in results)
+        assert 0 < detector.utilization <= 1
+        # the executor can be used by the detection components
+        p = hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 20000, detector.executor,
+                            report_p2=False)
+        assert 0 <= p <= 1
+    # the session gives the same results as a one-off detection
+    assert results[0] == detect_counterexample(noisy_max_v1a, (0.5, 1.0), {'epsilon': 0.7}, num_input=5,
+                                               event_iterations=20000, detect_iterations=20000, cores=1, quiet=True,
+                                               seed=1)
+
+
+def test_executors():
+    kwargs = {'epsilon': 0.7, 'N': 1, 'T': 0.5}
+    results = []
+    forkserver = concurrent.futures.ProcessPoolExecutor(2, mp_context=mp.get_context('forkserver'))
+    for executor in ('process', 'thread', 'serial', forkserver):
+        with Detector(2, executor=executor) as detector:
+            results.append(detector.detect(SVT_numba, (0.5, 1.0), kwargs, num_input=5, event_iterations=20000,
+                                           detect_iterations=20000, quiet=True, seed=3))
+    # the given executor is not shut down by the session
+    assert forkserver.submit(abs, -1).result() == 1
+    forkserver.shutdown()
+    # the results only depend on the seed
+    assert all(result == results[0] for result in results)
+    with pytest.raises(ValueError):
+        Detector(executor='unknown')
+
+
+def test_workers():
+    # the owned pools have the cores of the session, an existing executor has the given workers
+    for executor, workers in (('serial', 1), ('thread', 3)):
+        with Detector(3, executor=executor) as detector:
+            assert detector.workers == workers
+    with concurrent.futures.ThreadPoolExecutor(2) as threads:
+        with Detector(executor=threads, workers=2) as detector:
+            assert detector.workers == 2
+            detector.detect(noisy_max_v1a, 0.5, {'epsilon': 0.7}, num_input=5, event_iterations=10000,
+                            detect_iterations=10000, quiet=True, seed=1)
+            assert 0 < detector.utilization <= 1
+        # the utilization is not reported if the workers of the executor are unknown
+        with Detector(executor=threads) as detector:
+            detector.detect(noisy_max_v1a, 0.5, {'epsilon': 0.7}, num_input=5, event_iterations=10000,
+                            detect_iterations=10000, quiet=True, seed=1)
+            assert detector.workers is None and detector.utilization is None
+    with pytest.raises(ValueError):
+        Detector(2, executor='thread', workers=2)
+
+
+def test_detect_iter():
+    kwargs = {'epsilon': 0.7, 'N': 1, 'T': 0.5}
+    options = dict(num_input=5, event_iterations=20000, detect_iterations=20000, quiet=True, seed=5)
+    with Detector(2) as detector:
+        expected = detector.detect(SVT_numba, (0.3, 0.5, 0.7, 1.0), kwargs, **options)
+        # the results are tagged with their epsilon and only depend on the seed
+        results = list(detector.detect_iter(SVT_numba, (0.3, 0.5, 0.7, 1.0), kwargs, concurrent_epsilons=3,
+                                            **options))
+        assert sorted(results, key=lambda result: result[0]) == expected
+        assert detector.detect(SVT_numba, (0.3, 0.5, 0.7, 1.0), kwargs, concurrent_epsilons=1, **options) == expected
+        # stop after the first result
+        results = detector.detect_iter(SVT_numba, (0.3, 0.5, 0.7, 1.0), kwargs, concurrent_epsilons=2, **options)
+        assert next(results) in expected
+        results.close()
@@ -0,0 +1,85 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import time
+import pytest
+from statdp.algorithms import noisy_max_v1a, SVT_numba
+from statdp.distributed import DistributedExecutor
+from statdp.hypotest import hypothesis_test
+from statdp.selectors import select_event
+
+
+def _exit_once(marker):
+    # the first worker running this task dies, the re-issued task succeeds
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return 42
+
+
+def _hang_once(marker):
+    # the first worker running this task hangs, the re-issued task succeeds
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        time.sleep(5)
+    return 42
+
+
+def test_distributed_executor(tmp_path):
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    executor = DistributedExecutor()
+    executor.start_local_workers(2)
+    try:
+        # the results only depend on the seed
+        assert hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 50000, executor, seed=0) == \
+            hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 50000, None, seed=0)
+        input_list = ((d1, d2, {'epsilon': 0.5, 'N': 1, 'T': 0.5}), (d2, d1, {'epsilon': 0.5, 'N': 1, 'T': 0.5}))
+        assert select_event(SVT_numba, input_list, 0.5, 30000, executor, seed=0) == \
+            select_event(SVT_numba, input_list, 0.5, 30000, None, seed=0)
+        # exceptions are raised in the coordinator
+        with pytest.raises(ValueError):
+            executor.submit(int, 'not a number').result()
+        assert executor.submit(int, '11', base=2).result() == 3
+        # the task of a lost worker is re-issued to the remaining worker
+        assert executor.submit(_exit_once, str(tmp_path / 'marker')).result() == 42
+    finally:
+        executor.shutdown()
+
+
+def test_distributed_executor_cancel(tmp_path):
+    executor = DistributedExecutor(task_timeout=1)
+    try:
+        # the waiting tasks are not running yet and can be cancelled
+        cancelled, waiting = executor.submit(int, '1'), executor.submit(int, '2')
+        assert not cancelled.running() and cancelled.cancel()
+        executor.start_local_workers(2)
+        assert waiting.result() == 2 and cancelled.cancelled()
+        # the task of a hung worker is re-issued after the timeout
+        assert executor.submit(_hang_once, str(tmp_path / 'marker')).result() == 42
+    finally:
+        executor.shutdown()
+
+    executor = DistributedExecutor()
+    future = executor.submit(int, '1')
+    executor.shutdown(cancel_futures=True)
+    assert future.cancelled()
@@ -78,3 +78,55 @@ def test_sf():
         with pytest.raises(ValueError):
             # number of draws is greater than the total number of objects
             sf(1, 100, 20, 300)
+
+
+def test_ln_factorial_table():
+    table = hypergeom.ln_factorial_table(200)
+    assert len(table) == 201
+    assert table[0] == table[1] == 0
+    for n, k in ((200, 100), (5, 3), (67, 32)):
+        assert_almost_equal(np.log(comb(n, k)), table[n] - table[k] - table[n - k], 11)
+
+
+def test_pmf_table():
+    table = hypergeom.ln_factorial_table(10000)
+    for pmf in (hypergeom.pmf_table, hypergeom.pmf_table.py_func):
+        for M in range(1000, 10000, 500):
+            for n in range(1000, M, 500):
+                for N in range(10, 1000, 50):
+                    for k in range(10, N, 30):
+                        assert_almost_equal(pmf(k, M, n, N, table), reference.pmf(k, M, n, N), 9)
+        for k in range(3):
+            assert_almost_equal(pmf(k, 2500, 50, 500, table), reference.pmf(k, 2500, 50, 500), 11)
+        with pytest.raises(ValueError):
+            pmf(1, 100, 20, 300, table)
+
+
+def test_sf_table():
+    table = hypergeom.ln_factorial_table(10000)
+    for sf in (hypergeom.sf_table, hypergeom.sf_table.py_func):
+        for M in range(1000, 10000, 500):
+            for n in range(1000, M, 500):
+                for N in range(10, 1000, 50):
+                    for k in range(-10, N + 10, 30):
+                        assert_almost_equal(sf(k, M, n, N, table), reference.sf(k, M, n, N), 9)
+        with pytest.raises(ValueError):
+            sf(1, 100, 20, 300, table)
+
+
+def test_sf_normal():
+    for sf_normal in (hypergeom.sf_normal, hypergeom.sf_normal.py_func):
+        for N in (1000, 100000):
+            M, n = 2 * N, N
+            for draws in (3, 50, 100, 1000, N, M - 10):
+                sd = np.sqrt(draws * (n / M) * (1 - n / M) * (M - draws) / (M - 1))
+                for k in range(-1, draws + 1, max(1, draws // 200)):
+                    error = abs(sf_normal(k, M, n, draws) - reference.sf(k, M, n, draws))
+                    # documented maximum errors for n = M / 2
+                    assert error < 0.01 / sd
+                    if sd >= 5:
+                        assert error < 3e-4
+        assert sf_normal(20, 100, 5, 10) == 0
+        assert sf_normal(-1, 100, 5, 10) == 1
+        with pytest.raises(ValueError):
+            sf_normal(1, 100, 20, 300)
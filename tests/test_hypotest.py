@@ -20,11 +20,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import multiprocessing as mp
+import numpy as np
 from numpy.testing import assert_almost_equal
+from scipy.stats import binom, hypergeom
 import pytest
-from statdp.algorithms import noisy_max_v1a
+from statdp.algorithms import noisy_max_v1a, noisy_max_v1b
 # need to rename test_statistics function to prevent pytest from recognizing it as a test procedure
-from statdp.hypotest import hypothesis_test, test_statistics as statdp_test_statistics
+from statdp.hypotest import hypothesis_test, sequential_test, test_statistics as statdp_test_statistics, \
+    test_statistics_array as statdp_test_statistics_array
 
 
 @pytest.mark.parametrize('process_pool', (mp.Pool(1), mp.Pool()), ids=('SingleCore', 'MultiCore'))
@@ -48,3 +51,89 @@ def test_test_statistics():
     for func in (statdp_test_statistics, statdp_test_statistics.py_func):
         assert_almost_equal(func(1000, 1000, 1, 2000), 1)
         assert_almost_equal(func(1999, 1, 1, 2000), 0)
+
+
+def test_test_statistics_precision():
+    # compare with the exact expectation over the binomial distribution computed by scipy
+    for cx, cy, epsilon, iterations in ((500, 300, 0.5, 1000), (10, 3, 0.1, 100), (7, 0, 0.7, 10),
+                                        (40000, 20000, 0.7, 100000), (5000, 3000, 0.3, 20000)):
+        k = np.arange(cx + 1)
+        expected = np.sum(binom.pmf(k, cx, np.exp(-epsilon)) * hypergeom.sf(k - 1, 2 * iterations, iterations, k + cy))
+        for func in (statdp_test_statistics, statdp_test_statistics.py_func):
+            p_value = func(cx, cy, epsilon, iterations)
+            assert_almost_equal(p_value, expected, 9)
+            # the p-value is computed deterministically
+            assert func(cx, cy, epsilon, iterations) == p_value
+    assert statdp_test_statistics(0, 10, 0.5, 100) == 1
+    assert statdp_test_statistics(10, 5, float('inf'), 100) == 1
+
+
+def test_test_statistics_array():
+    cx, cy = np.array([500, 10, 1000, 1999, 0]), np.array([300, 3, 1000, 1, 5])
+    for func in (statdp_test_statistics_array, statdp_test_statistics_array.py_func):
+        p_values = func(cx, cy, 0.5, 2000)
+        assert p_values.shape == (5, )
+        for p_value, (local_cx, local_cy) in zip(p_values, zip(cx, cy)):
+            assert_almost_equal(p_value, statdp_test_statistics(local_cx, local_cy, 0.5, 2000), 11)
+
+
+def test_test_statistics_approximate():
+    for cx, cy, epsilon, iterations in ((500, 300, 0.5, 1000), (10, 3, 0.1, 100), (40000, 20000, 0.7, 100000),
+                                        (400000, 201000, 0.7, 1000000), (450000, 420000, 0.05, 1000000)):
+        for func in (statdp_test_statistics, statdp_test_statistics.py_func):
+            assert abs(func(cx, cy, epsilon, iterations, True) - func(cx, cy, epsilon, iterations)) < 3e-4
+
+
+def test_hypothesis_test_method():
+    with mp.Pool(1) as process_pool:
+        d1, d2 = [0] + [2 for _ in range(4)], [1 for _ in range(5)]
+        p1, p2 = hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 100000, process_pool,
+                                 method='approximate', seed=0)
+        assert 0 <= p1 <= 0.05
+        assert 0.95 <= p2 <= 1.0
+        # the method used is returned on request, 'auto' uses the exact method for few iterations
+        assert hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 100000, process_pool,
+                               method='approximate', seed=0, return_method=True) == (p1, p2, 'approximate')
+        p, method = hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 5000, process_pool,
+                                    report_p2=False, seed=0, return_method=True)
+        assert method == 'exact'
+        # the p-values of report_p2 are computed in one pass, and agree with the single p-value
+        assert hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 5000, process_pool,
+                               seed=0)[0] == pytest.approx(p)
+        assert p == hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 5000, process_pool,
+                                    report_p2=False, seed=0)
+        with pytest.raises(ValueError):
+            hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.25, 100000, process_pool,
+                            method='unknown')
+
+
+def test_hypothesis_test_seed():
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    p_values = []
+    for processes in (1, 2, 1):
+        with mp.Pool(processes) as process_pool:
+            p_values.append(hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 35000, process_pool,
+                                            seed=42))
+    assert p_values[0] == p_values[1] == p_values[2]
+
+
+def test_sequential_test():
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    with mp.Pool(1) as process_pool:
+        # far from the decision boundary in both directions, the test stops after the first look
+        p, iterations = sequential_test(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, ((-float('inf'), 1.5), ), 0.5,
+                                        500000, process_pool, alpha=0.05, seed=0)
+        assert p <= 0.05 and iterations < 500000
+        p, iterations = sequential_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 2.0, 500000, process_pool,
+                                        alpha=0.05, seed=0)
+        assert p > 0.05 and iterations < 500000
+        # the counts of a test running to the end are the same as hypothesis_test, the p-value is adjusted for the looks
+        p, iterations = sequential_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 5000, process_pool,
+                                        alpha=0.05, seed=0)
+        assert iterations == 5000
+        assert p == pytest.approx(hypothesis_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 5000,
+                                                  process_pool, report_p2=False, seed=0))
+        with pytest.raises(ValueError):
+            sequential_test(noisy_max_v1a, d1, d2, {'epsilon': 0.5}, (0, ), 0.5, 5000, process_pool, alpha=1.5)
@@ -0,0 +1,94 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import pytest
+import statdp.core
+from statdp.__main__ import main, load_jobs
+from statdp.generators import ONE_DIFFER
+
+jobs = {
+    'defaults': {'test_epsilon': [0.2, 0.7], 'claimed_epsilon': 0.7, 'event_iterations': 10000,
+                 'detect_iterations': 20000, 'num_input': [5], 'seed': 0},
+    'jobs': [
+        {'algorithm': 'statdp.algorithms:noisy_max_v1b'},
+        {'algorithm': 'statdp.algorithms.SVT', 'kwargs': {'N': 1, 'T': 0.5}, 'claimed_epsilon': [0.2, 0.7]},
+        {'algorithm': 'statdp.algorithms:histogram', 'sensitivity': 'ONE_DIFFER', 'name': 'histogram_one'}
+    ]
+}
+
+
+def test_load_jobs(tmp_path):
+    job_file = tmp_path / 'jobs.json'
+    job_file.write_text(json.dumps(jobs))
+    svt, histogram = load_jobs(job_file)[1:]
+    assert svt['name'] == 'SVT' and svt['claimed_epsilon'] == (0.2, 0.7) and svt['kwargs'] == {'N': 1, 'T': 0.5}
+    assert histogram['name'] == 'histogram_one' and histogram['sensitivity'] == ONE_DIFFER
+    assert histogram['options'] == {'event_iterations': 10000, 'detect_iterations': 20000, 'num_input': (5, ),
+                                    'seed': 0}
+
+    yaml = pytest.importorskip('yaml')
+    job_file = tmp_path / 'jobs.yaml'
+    job_file.write_text(yaml.safe_dump({'jobs': [{'algorithm': 'statdp.algorithms:SVT', 'kwargs': {'N': 1},
+                                                  'test_epsilon': {'start': 0.1, 'stop': 0.5, 'step': 0.1}}]}))
+    assert load_jobs(job_file)[0]['test_epsilon'] == (0.1, 0.2, 0.3, 0.4, 0.5)
+
+    for wrong_job in ({'algorithm': 'statdp.algorithms:SVT'}, {'algorithm': 'SVT', 'test_epsilon': 0.5},
+                      {'algorithm': 'statdp.algorithms:SVT', 'test_epsilon': 0.5, 'iterations': 100}):
+        job_file.write_text(json.dumps([wrong_job]))
+        with pytest.raises(ValueError):
+            load_jobs(job_file)
+
+
+def _strict_loads(line):
+    # -Infinity / NaN are not JSON
+    def reject(constant):
+        raise ValueError(f'{constant} is not valid JSON')
+    return json.loads(line, parse_constant=reject)
+
+
+def test_main(tmp_path, monkeypatch):
+    # the memory budget set by main is restored afterwards
+    monkeypatch.setattr(statdp.core, 'MEMORY_BUDGET', statdp.core.MEMORY_BUDGET)
+    monkeypatch.setenv('STATDP_MEMORY_BUDGET', str(statdp.core.MEMORY_BUDGET))
+    job_file, output = tmp_path / 'jobs.json', tmp_path / 'results.jsonl'
+    job_file.write_text(json.dumps(jobs))
+    arguments = [str(job_file), '--output', str(output), '--cores', '1', '--executor', 'thread',
+                 '--memory-budget', str(2 ** 16), '--loglevel', 'WARNING']
+    assert main(arguments) == 0
+    records = [_strict_loads(line) for line in output.read_text().splitlines()]
+    # 4 detections with 2 test epsilons each
+    assert len(records) == 8
+    assert {(record['job'], record['claimed_epsilon']) for record in records} == \
+        {('noisy_max_v1b', 0.7), ('SVT', 0.2), ('SVT', 0.7), ('histogram_one', 0.7)}
+    assert all(record['kwargs']['epsilon'] == record['claimed_epsilon'] for record in records)
+    # the infinities of the events are written as strings
+    assert any(record['event'][0][0] == '-inf' for record in records if record['job'] == 'noisy_max_v1b')
+
+    # the finished detections are skipped when resuming
+    lines = output.read_text().splitlines()
+    output.write_text('\n'.join(lines[2:]) + '\n')
+    assert main(arguments + ['--resume', '--alpha', '0.05']) == 0
+    records = [_strict_loads(line) for line in output.read_text().splitlines()]
+    assert len(records) == 8 and sum('iterations' in record for record in records) == 2
+
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / 'missing.json')])
@@ -19,10 +19,13 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import logging
 import multiprocessing as mp
 import pytest
-from statdp.algorithms import noisy_max_v1a, noisy_max_v1b
-from statdp.selectors import select_event
+from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, SVT
+from statdp.core import BLOCK_SIZE
+from statdp.selectors import select_event, select_event_halving, sample_events, _halving_schedule, _input_bounds, \
+    _p_values, _rank_events
 
 
 @pytest.mark.parametrize('process_pool', (mp.Pool(1), mp.Pool()), ids=('SingleCore', 'MultiCore'))
@@ -34,3 +37,106 @@ def test_select_event(process_pool):
         assert event == (0, )
         _, _, _, event = select_event(noisy_max_v1b, ((d1, d2, {'epsilon': 0.5}),), 0.5, 100000, process_pool)
         assert event[0][0] < 0 < event[0][1]
+
+
+@pytest.mark.parametrize('process_pool', (mp.Pool(1), mp.Pool()), ids=('SingleCore', 'MultiCore'))
+def test_reuse_samples(process_pool):
+    with process_pool:
+        d1 = [0] + [2 for _ in range(4)]
+        d2 = [1 for _ in range(5)]
+        input_list = ((d1, d2, {'epsilon': 0.5}),)
+        samples = sample_events(noisy_max_v1a, input_list, 100000, process_pool)
+        counts, input_event_pairs = samples
+        assert len(counts) == len(input_event_pairs) >= 1
+        for epsilon in (0.25, 0.5, 0.75):
+            _, _, _, event = select_event(noisy_max_v1a, input_list, epsilon, 100000, process_pool, samples=samples)
+            assert event == (0, )
+
+
+def test_sample_events_many_categories():
+    # the index outputs are categorical events although the first block has more than 0.2% distinct values
+    _, input_event_pairs = sample_events(noisy_max_v1a, (([0] * 30, [0] * 30, {'epsilon': 0.5}), ), 20000, None,
+                                         quiet=True, seed=0)
+    assert sorted(pair[3] for pair in input_event_pairs) == [(index, ) for index in range(30)]
+
+
+def test_seed():
+    input_list = (([1, 2, 1], [2, 1, 1], {'epsilon': 0.5}), ([0, 2, 2], [1, 1, 1], {'epsilon': 0.5}))
+    samples, events = [], []
+    for processes in (1, 2):
+        with mp.Pool(processes) as process_pool:
+            samples.append(sample_events(noisy_max_v1b, input_list, 10000, process_pool, seed=7))
+            events.append(select_event(SVT, ((input_list[0][0], input_list[0][1], {'epsilon': 0.5, 'N': 1, 'T': 0.5}),),
+                                       0.5, 10000, process_pool, seed=7))
+    assert samples[0] == samples[1]
+    assert events[0] == events[1]
+
+
+def test_sample_events_blocks():
+    # the iterations are not a multiple of the block size
+    iterations = 25000
+    input_list = (([1, 2, 1], [2, 1, 1], {'epsilon': 0.5}), ([0, 2, 2], [1, 1, 1], {'epsilon': 0.5}))
+    with mp.Pool(2) as process_pool:
+        counts, input_event_pairs = sample_events(noisy_max_v1a, input_list, iterations, process_pool)
+    assert [pair[:3] for pair in input_event_pairs] == sorted([pair[:3] for pair in input_event_pairs],
+                                                             key=lambda pair: input_list.index(pair))
+    for input_triplet in input_list:
+        # the categorical events of an input partition its outputs
+        assert sum(cx + cy for (cx, cy), pair in zip(counts, input_event_pairs) if pair[:3] == input_triplet) == \
+            2 * iterations
+    # the p-values are ranked on the events of each input
+    bounds = _input_bounds(input_event_pairs)
+    assert [input_event_pairs[start][:3] for start, _ in bounds] == list(input_list)
+    assert all(pair[:3] == input_event_pairs[start][:3]
+               for start, end in bounds for pair in input_event_pairs[start:end])
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(counts)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(bounds, bounds[1:]))
+
+
+def test_select_event_halving():
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    # the useful input should survive the rounds among the inputs which cannot tell the algorithms apart
+    input_list = [(d1, d1, {'epsilon': 0.5}) for _ in range(4)] + [(d1, d2, {'epsilon': 0.5})] + \
+                 [(d2, d2, {'epsilon': 0.5}) for _ in range(3)]
+    with mp.Pool(2) as process_pool:
+        results = [select_event_halving(noisy_max_v1a, input_list, 0.5, 20000, process_pool, seed=seed)
+                   for seed in (0, 0)]
+        assert results[0] == results[1] == (d1, d2, {'epsilon': 0.5}, (0, ))
+        _, _, _, event = select_event_halving(noisy_max_v1b, input_list, 0.5, 20000, process_pool)
+        assert event[0][0] < 0 < event[0][1]
+        with pytest.raises(ValueError):
+            select_event_halving(noisy_max_v1a, input_list, 0.5, 20000, process_pool, eta=1)
+
+
+def test_halving_schedule():
+    # the blocks of all rounds stay within the budget
+    for input_number, iterations, eta in ((16, 10000, 2), (8, 20000, 2), (10, 100000, 2), (10, 500000, 3)):
+        schedule = _halving_schedule(input_number, iterations, eta)
+        assert sum(number * blocks for number, blocks in schedule) * BLOCK_SIZE <= input_number * iterations
+        assert schedule[0][0] == input_number and all(blocks >= 1 for _, blocks in schedule)
+    # the rounds which cannot run one block per input are dropped
+    assert _halving_schedule(16, 10000, 2) == [(16, 1)]
+    assert _halving_schedule(8, 20000, 2) == [(8, 1), (4, 2)]
+    # there is a single round for 2 inputs, and every input runs at least one block
+    assert _halving_schedule(2, 100000, 2) == [(2, 10)]
+    assert _halving_schedule(4, 100, 2) == [(4, 1)]
+
+
+def test_rank_events(caplog):
+    counts = [(500, 400), (900, 100), (10, 0), (900, 100), (600, 550)]
+    p_values = _p_values(counts, 0.5, 10000)
+    # the best events with ties broken by the position, the events with too few outputs come last
+    assert _rank_events((3, counts), 0.5, 10000, 1) == (3, [(p_values[1], 1)])
+    _, ranks = _rank_events((0, counts), 0.5, 10000, None)
+    assert [position for _, position in ranks] == [1, 3, 0, 4, 2]
+    assert [p for p, _ in ranks] == sorted(p_values)
+
+    # the full table is only sent back and logged at the debug level, which selects the same event
+    d1 = [0] + [2 for _ in range(4)]
+    d2 = [1 for _ in range(5)]
+    input_list = [(d1, d2, {'epsilon': 0.5}), (d2, d1, {'epsilon': 0.5})]
+    selected = select_event(noisy_max_v1b, input_list, 0.5, 20000, None, quiet=True, seed=1)
+    with caplog.at_level(logging.DEBUG, logger='statdp.selectors'):
+        assert select_event(noisy_max_v1b, input_list, 0.5, 20000, None, quiet=True, seed=1) == selected
+    assert sum('p-value' in record.message for record in caplog.records) > len(input_list)
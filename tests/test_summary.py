@@ -0,0 +1,74 @@
+# MIT License
+#
+# Copyright (c) 2020 Yuxin Wang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import numpy as np
+import pytest
+from statdp.algorithms import noisy_max_v1a, noisy_max_v1b, histogram, iSVT4, SVT_numba
+from statdp.core import count_events
+from statdp.summary import summarize_outputs
+
+
+@pytest.mark.parametrize('algorithm, kwargs', ((noisy_max_v1a, {'epsilon': 0.5}), (noisy_max_v1b, {'epsilon': 0.5}),
+                                               (histogram, {'epsilon': 0.5}),
+                                               (iSVT4, {'epsilon': 0.5, 'N': 1, 'T': 0.5}),
+                                               (SVT_numba, {'epsilon': 0.5, 'N': 1, 'T': 0.5})))
+def test_summary_counts(algorithm, kwargs):
+    d1, d2 = [0] + [2 for _ in range(4)], [1 for _ in range(5)]
+    summary = summarize_outputs(algorithm, d1, d2, kwargs, 10000, seed=0)
+    # the events of the search space are counted exactly
+    event_dict = count_events(algorithm, d1, d2, kwargs, None, 10000, seed=0)
+    assert summary.count() == event_dict
+    # the summaries with the same layout are merged
+    other = summarize_outputs(algorithm, d1, d2, kwargs, 10000, layout=summary.layout, seed=1)
+    other_dict = count_events(algorithm, d1, d2, kwargs, None, 10000, seed=1, events=summary.events)
+    assert summary.merge(other).count() == {event: (cx + other_dict[event][0], cy + other_dict[event][1])
+                                            for event, (cx, cy) in event_dict.items()}
+    # the events with a component holding too few outputs are pruned, which cannot hold more outputs either
+    pruned_dict = summary.count(min_count=1000)
+    assert all(pruned_dict[event] == event_dict[event] for event in pruned_dict)
+    assert all(sum(event_dict[event]) <= 1000 for event in set(event_dict) - set(pruned_dict))
+
+
+def test_summary_size():
+    d1, d2 = [0] + [2 for _ in range(4)], [1 for _ in range(5)]
+    sizes = []
+    for iterations in (10000, 40000):
+        summary = summarize_outputs(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, iterations, seed=0,
+                                    memory_budget=16 * 5000)
+        sizes.append(len(summary.cells))
+        assert summary.counts_d1.sum() == summary.counts_d2.sum() == iterations
+    # the size of the summary is bounded by the resolution, not the iterations
+    assert sizes[1] <= 2 * 300
+
+    # new events are counted on the summary without re-sampling, with an error bounded by the resolution
+    new_events = [((-float('inf'), threshold), ) for threshold in (-1.3, 0.1, 2.7)]
+    counts = summary.count(new_events)
+    expected = count_events(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, None, 40000, seed=0, events=new_events,
+                            memory_budget=16 * 5000)
+    for event in new_events:
+        assert np.allclose(counts[event], expected[event], atol=0.01 * 40000)
+    with pytest.raises(ValueError):
+        summarize_outputs(noisy_max_v1b, d1, d2, {'epsilon': 0.5}, 0)
+
+    # the search space does not depend on the memory budget
+    for algorithm in (noisy_max_v1a, noisy_max_v1b):
+        assert summarize_outputs(algorithm, d1, d2, {'epsilon': 0.5}, 10000, seed=0).events == \
+            summarize_outputs(algorithm, d1, d2, {'epsilon': 0.5}, 10000, seed=0, memory_budget=2 ** 14).events